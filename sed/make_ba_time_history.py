@@ -1,10 +1,36 @@
 #!/usr/bin/env python
 """Create time history files for sediment simulations with an upstream boundary
 at Beaver Army Terminal using a rating curve developed from USGS data.
+
+All sediment classes are computed together from a table of rating curve
+coefficients and class fractions, giving a (time, class) array in one
+broadcast, and all htr_N.th files are written in one pass over it.
+
+flux.th is read a block of rows at a time and every block goes through the
+rating curve straight to the htr_N.th files, so memory use does not grow
+with the length of the record (unless plotting).
+
+With --ensemble N, slopes b are drawn from N(b, std_err) for N members
+(silt classes share one draw per member, as they share one curve).  The
+standard error of a slope describes its uncertainty about the centroid
+of the fit, so each drawn curve pivots about log(flux) = log_flux_mean,
+
+    a' = a - (b' - b)*log_flux_mean
+
+keeping the concentration at the typical fitted flux and spreading it
+towards low and high flows.  Each member's htr_N.th files and the drawn
+coefficients (coefs.txt) go to <outdir>/member_NNN/ and <outdir>/.  Groups of
+members are evaluated as one (member, time, class) array per block of
+rows by a pool of worker processes.
 """
+import multiprocessing
+import os
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+import th
+
 # -----------------------------------------------------------------------------
 # Constants
 # -----------------------------------------------------------------------------
@@ -12,115 +38,242 @@ import matplotlib.pyplot as plt
 # USGS data from Beaver Army Terminal 1990 - 2015
 # http://cida.usgs.gov/sediment/
 
+# std_err is the standard error of the slope b and log_flux_mean the
+# centroid mean(log(flux)) of the fit, about which ensemble slopes pivot.
+# The fitted samples are not kept here, log_flux_mean is log of the
+# 1990 - 2015 mean flow at Beaver Army (~7000 m3/s), replace it with the
+# samples' mean(log(flux)) when the curves are refit.
+LOG_FLUX_MEAN = 8.85
+
 # Total SPM
-# r2 = 0.786, p < 0.01, std_err = 0.088
-SPM = {'a': -18.6132492602, 'b':  1.65095653426}
+# r2 = 0.786, p < 0.01
+SPM = {'a': -18.6132492602, 'b':  1.65095653426, 'std_err': 0.088,
+       'log_flux_mean': LOG_FLUX_MEAN}
 
 # Silt class, or those less than d50 (P63)
-# r2 = 0.740, p < 0.01, std_err = 0.088
-SILT = {'a': -16.938280665, 'b':  1.43398603797}
+# r2 = 0.740, p < 0.01
+SILT = {'a': -16.938280665, 'b':  1.43398603797, 'std_err': 0.088,
+        'log_flux_mean': LOG_FLUX_MEAN}
 
 # Sand class, or those greater than d50 (P63)
-# r2 = 0.742, p < 0.01, std_err = 0.162
-SAND = {'a': -29.3524701378, 'b':  2.64448615935}
+# r2 = 0.742, p < 0.01
+SAND = {'a': -29.3524701378, 'b':  2.64448615935, 'std_err': 0.162,
+        'log_flux_mean': LOG_FLUX_MEAN}
 
 # Percent of silt/clay sizes from LMER water samples (data + Fain et al. 2001)
 # wash = 0.07
 # fine silt = 0.40
 # coarse silt = 0.53
 
+# Format of htr_N.th rows
+TIME_FMT = '%d'
+CONC_FMT = '%.2e'
+
+# Ensemble members written by one worker task
+MEMBERS_PER_TASK = 32
+
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
-def make_th_files(fluxpath, silt_percents, plot=False):
+def make_th_files(fluxpath, silt_percents, plot=False, chunk=th.CHUNK_ROWS):
     """Create .th files based on Beaver Army rating curve."""
-    time, flux = read_flux(fluxpath)
-
-    silt = calc_silt(flux)
-    sand = calc_sand(flux)
-    silts = calc_silt_classes(silt, silt_percents)
-    write_th_files(time, silts, sand)
+    names, coefs = make_classes(silt_percents)
+    blocks = iter_conc(fluxpath, coefs, chunk)
+    if plot:
+        blocks = list(blocks)
+    write_th_files(blocks, names)
     if plot:
-        make_plots(time, silts, sand)
+        time = np.concatenate([t for t, _ in blocks])
+        conc = np.concatenate([c for _, c in blocks])
+        make_plots(time, conc, names)
+
+
+def iter_flux(fluxpath, chunk=th.CHUNK_ROWS):
+    """Yield (time, flux) blocks of a flux file."""
+    print 'Reading flux file %s' % fluxpath
+    for time, data in th.iter_ascii_th(fluxpath, chunk):
+        # Only have positive values on inflow (negative values)
+        flux = -1*data[:, 0]
+        # Miniscule value when flowing upstream
+        flux[flux <= 0.0] = 0.001
+        yield time, flux
 
 
 def read_flux(fluxpath):
     """Read and return a flux file."""
-    print 'Reading flux file %s' % fluxpath
-    data = np.genfromtxt(fluxpath)
-    time = data[:, 0]
-    # Only have positive values on inflow (negative values)
-    flux = -1*data[:, 1]
-    # Miniscule value when flowing upstream
-    flux[flux <= 0.0] = 0.001
+    blocks = list(iter_flux(fluxpath))
+    return (np.concatenate([t for t, _ in blocks]),
+            np.concatenate([q for _, q in blocks]))
 
-    return time, flux
 
+def iter_conc(fluxpath, coefs, chunk=th.CHUNK_ROWS):
+    """Yield (time, concentrations) blocks for the classes in coefs."""
+    for time, flux in iter_flux(fluxpath, chunk):
+        yield time, rating_curve(flux, coefs)
 
-def calc_sand(flux):
-    """Calculate and return sand concentrations based on BA flux."""
-    sand = np.exp(SAND['a'] + np.log(flux)*SAND['b'])
-    return sand
 
+def make_classes(silt_percents):
+    """Return class names and rating table of silt classes and sand.
 
-def calc_silt(flux):
-    """Calculate and return sand concentrations based on BA flux."""
-    silt = np.exp(SILT['a'] + np.log(flux)*SILT['b'])
-    return silt
+    Params:
+    -------
+    silt_percents - list of float
+        fraction of the silt rating curve in each silt/clay class
 
+    Returns:
+    --------
+    names - list of str
+        'silt/clay' per silt class, then 'sand'
+    coefs - np.array (nclasses, 5)
+        a, b, fraction, std_err of b and log_flux_mean of each class
+    """
+    names = ['silt/clay']*len(silt_percents) + ['sand']
+    coefs = [(SILT['a'], SILT['b'], p, SILT['std_err'],
+              SILT['log_flux_mean']) for p in silt_percents]
+    coefs.append((SAND['a'], SAND['b'], 1.0, SAND['std_err'],
+                  SAND['log_flux_mean']))
+    return names, np.array(coefs)
 
-def calc_silt_classes(silt, silt_percents):
-    """Calculate silts by percents in silts"""
-    silts = []
-    for s in silt_percents:
-        silts.append(silt*s)
-    return silts
 
+def sample_coefs(coefs, nmembers, seed=None):
+    """Return (nmembers, nclasses, 5) tables with slopes b drawn per member.
 
-def make_plots(time, silts, sand):
+    b is drawn from N(b, std_err) and a moved so that the curve pivots
+    about log_flux_mean, classes with the same curve (a, b) share each
+    draw.
+    """
+    curves, curve = np.unique(coefs[:, :2], axis=0, return_inverse=True)
+    draws = np.random.RandomState(seed).standard_normal(
+        (nmembers, curves.shape[0]))
+    members = np.repeat(coefs[None], nmembers, axis=0)
+    db = draws[:, curve]*coefs[:, 3]
+    members[:, :, 1] += db
+    members[:, :, 0] -= db*coefs[:, 4]
+    return members
+
+
+def rating_curve(flux, coefs):
+    """Return concentrations (..., ntimes, nclasses) of all classes.
+
+    c = fraction*exp(a + log(flux)*b), broadcast over times and classes,
+    and over members for (nmembers, nclasses, 5) coefs.
+    """
+    a = coefs[..., None, :, 0]
+    b = coefs[..., None, :, 1]
+    frac = coefs[..., None, :, 2]
+    return frac*np.exp(a + np.log(flux)[:, None]*b)
+
+
+def make_plots(time, conc, names):
     """Make a plot of the resulting time series of silts + sands."""
-    nplots = len(silts)+1
+    nplots = conc.shape[1]
     fig, ax = plt.subplots(nplots, 1, sharex=True)
 
-    # Silts
-    for i, s in enumerate(silts):
-        ax[i].plot(time, s, label='silt %d' % (i+1))
+    for i, name in enumerate(names):
+        label = name.split('/')[0]
+        if name != 'sand':
+            label = '%s %d' % (label, i+1)
+        ax[i].plot(time, conc[:, i], label=label)
         ax[i].set_ylabel('SSC [kg/m3]')
         ax[i].set_xlabel('Simulation time')
         ax[i].legend()
 
-    # Sand
-    ax[-1].plot(time, sand, label='sand')
-    ax[-1].set_ylabel('SSC [kg/m3]')
-    ax[-1].set_xlabel('Simulation time')
-    ax[-1].legend()
-
     # Save
     figname = 'sed_tracer_th.png'
     print 'Saving figure %s' % figname
     plt.savefig(figname)
 
 
-def write_th_files(time, silts, sand):
-    """Create time history files."""
-    out_num = 0
-    out_fmt = '%d %.2e'
+def write_th_files(blocks, names, outdirs=('.',)):
+    """Create htr_N.th of every class, writing all of them in one pass.
+
+    blocks yields time (n,) and concentrations (n, nclasses), or
+    (len(outdirs), n, nclasses) with one member per output directory.
+    """
+    files = []
+    for outdir in outdirs:
+        for i, name in enumerate(names):
+            fname = os.path.join(outdir, 'htr_%s.th' % (i+1))
+            if len(outdirs) == 1:
+                print 'Writing class %d (%s) to %s' % (i+1, name, fname)
+            files.append(th.ThWriter(fname, fmt='ascii', ascii_fmt=CONC_FMT,
+                                     time_fmt=TIME_FMT))
+    try:
+        for time, conc in blocks:
+            conc = conc.reshape((-1, time.shape[0], len(names)))
+            for j, member in enumerate(conc):
+                for i in xrange(len(names)):
+                    files[j*len(names) + i].write(time, member[:, i])
+    finally:
+        for f in files:
+            f.close()
+
 
-    # Silts
-    for s in silts:
-        out_num = out_num + 1
-        out = np.array([time, s]).T
-        fname = 'htr_%s.th' % out_num
-        print 'Writing class %d (silt/clay) to %s' % (out_num, fname)
-        np.savetxt(fname, out, fmt=out_fmt)
+def _write_members(args):
+    """Pool worker, write the htr_N.th files of a group of members."""
+    fluxpath, names, coefs, outdirs = args
+    chunk = max(1, th.CHUNK_ROWS // len(outdirs))
+    write_th_files(iter_conc(fluxpath, coefs, chunk), names, outdirs)
+    return outdirs
 
-    # Sand
-    out_num = out_num + 1
-    out = np.array([time, sand]).T
-    fname = 'htr_%s.th' % out_num
-    print 'Writing class %d (sand) to %s' % (out_num, fname)
-    np.savetxt(fname, out, fmt=out_fmt)
+
+def make_ensemble(fluxpath, silt_percents, nmembers, outdir='ensemble',
+                  seed=None, nprocs=None):
+    """Create htr_N.th files of nmembers perturbed rating curves.
+
+    Params:
+    -------
+    fluxpath - str
+        path to flux.th
+    silt_percents - list of float
+        fraction of the silt rating curve in each silt/clay class
+    nmembers - int
+        number of ensemble members
+    outdir - str
+        directory holding one member_NNN directory per member
+    seed - int, optional
+        random seed, for reproducible ensembles
+    nprocs - int, optional
+        number of worker processes, defaults to number of cores
+    """
+    names, coefs = make_classes(silt_percents)
+    members = sample_coefs(coefs, nmembers, seed)
+    outdirs = [os.path.join(outdir, 'member_%03d' % (i+1))
+               for i in xrange(nmembers)]
+    for d in outdirs:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    write_ensemble_coefs(os.path.join(outdir, 'coefs.txt'), members)
+
+    tasks = [(fluxpath, names, members[i:i+MEMBERS_PER_TASK],
+              outdirs[i:i+MEMBERS_PER_TASK])
+             for i in xrange(0, nmembers, MEMBERS_PER_TASK)]
+    print 'Writing %d members to %s' % (nmembers, outdir)
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        for done in pool.imap_unordered(_write_members, tasks):
+            print '- %s to %s' % (done[0], done[-1])
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_ensemble_coefs(path, members):
+    """Write 'member class a b fraction' rows of the sampled coefficients.
+
+    The header records the log_flux_mean each class's curves pivot about.
+    """
+    nmembers, nclasses = members.shape[:2]
+    ids = np.indices((nmembers, nclasses)).reshape((2, -1)).T + 1
+    table = np.column_stack((ids, members[:, :, :3].reshape((-1, 3))))
+    with open(path, 'w') as f:
+        f.write('# slopes b ~ N(b, std_err), a = a0 - (b - b0)*log_flux_mean\n')
+        f.write('# log_flux_mean per class: %s\n'
+                % ' '.join('%g' % v for v in members[0, :, 4]))
+        f.write('# member class a b fraction\n')
+        f.write(('%d %d %.10f %.10f %f\n'*table.shape[0])
+                % tuple(table.ravel()))
 
 
 def main():
@@ -130,6 +283,13 @@ def main():
     parser.add_argument('-s', '--silt_perc', type=str,
                         help='Custum percent of spm per silt class, e.g. \'0.25,0.5,0.75\'')
     parser.add_argument('-p', '--plot', action='store_true', default=False, help='plot results')
+    parser.add_argument('-e', '--ensemble', type=int,
+                        help='Number of ensemble members with perturbed slopes.')
+    parser.add_argument('-o', '--outdir', type=str, default='ensemble',
+                        help='Ensemble output directory.')
+    parser.add_argument('--seed', type=int, help='Ensemble random seed.')
+    parser.add_argument('-n', '--nprocs', type=int,
+                        help='Number of worker processes for the ensemble.')
     args = parser.parse_args()
     if args.silt_perc:
         silt_percents = [float(s) for s in args.silt_perc.split(',')]
@@ -139,7 +299,11 @@ def main():
     print 'Using %d silt/clay classes' % len(silt_percents)
     for i, p in enumerate(silt_percents):
         print '- silt/clay class %d : %f' % (i+1, p)
-    make_th_files(args.flux_file, silt_percents, args.plot)
+    if args.ensemble:
+        make_ensemble(args.flux_file, silt_percents, args.ensemble,
+                      args.outdir, args.seed, args.nprocs)
+    else:
+        make_th_files(args.flux_file, silt_percents, args.plot)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1 @@
+../selfe/th.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../selfe/gr3.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../selfe/gr3_field.py
\ No newline at end of file
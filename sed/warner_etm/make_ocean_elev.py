@@ -25,6 +25,9 @@ if 'stccmop' in os.environ.get('HOSTNAME'):
     matplotlib.use('AGG')
 import matplotlib.pyplot as plt
 
+import th
+import tides
+
 # ------------------------------------------------------------------------------
 # Functions - Q = U*H*sin(2*pi*t/T)
 # ------------------------------------------------------------------------------
@@ -51,31 +54,24 @@ def make_tidal_elev(times, tide, dt):
       Tidal periods:
       --------------
       T = 2 \pi / \omega
+
+      Evaluated with tides.Harmonics, sin is cos with a 90 degree phase.
     """
     if tide == 'sd':
-        amp = 0.4                   # meters
-        omega = 2*np.pi/(12*60*60)  # 12 hours
-        eta = amp*np.sin(omega*times)
+        amp = [0.4]                         # meters
+        omega = [2*np.pi/(12*60*60)]        # 12 hours
     else:
-        amp1 = 0.45
-        omega1 = 2*np.pi/(14*24*60*60)
-        amp2 = 0.4                   # meters
-        omega2 = 2*np.pi/(12*60*60)  # 12 hours
-
-        eta1 = amp1*np.sin(omega1*times)
-        eta2 = amp2*np.sin(omega2*times)
-        eta = eta1 + eta2
+        amp = [0.45, 0.4]
+        omega = [2*np.pi/(14*24*60*60), 2*np.pi/(12*60*60)]
 
-    return eta
+    harm = tides.Harmonics([tide]*len(amp), omega, amp, [90.0]*len(amp))
+    return harm.synthesize(times)[:, 0]
 
 
 def write_elev_to_file(times, elev, fn='elev.th.new'):
     """Write to file for input at time history file."""
     print '- saving elev time history to %s' % fn
-    f = file(fn, 'w')
-    for i in range(len(times)):
-        f.write('%f %f\n' % (times[i], elev[i]))
-    f.close()
+    th.write_ascii_th(fn, times, elev)
 
 
 def make_plot(times, elev, tide):
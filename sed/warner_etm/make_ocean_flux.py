@@ -19,16 +19,13 @@ T = 12*3600     # Tidal period (12 hours * 3600 seconds) (s)
 # Imports 
 #-------------------------------------------------------------------------------
 import numpy as np
-import math
+
+import th
 
 #-------------------------------------------------------------------------------
 # Functions - Q = U*H*sin(2*pi*t/T)
 #-------------------------------------------------------------------------------
-times = range(TIME_STEP, NDAYS*86400, TIME_STEP)
-
-f = file('flux.th.new', 'w')
-for i in range(len(times)):
-  flux = U*H*math.sin(2.0*math.pi*times[i]/T)
-  f.write('%f %f\n' % (times[i], flux)) 
+times = np.arange(TIME_STEP, NDAYS*86400, TIME_STEP)
+flux = U*H*np.sin(2.0*np.pi*times/T)
 
-f.close()
+th.write_ascii_th('flux.th.new', times, flux)
@@ -5,6 +5,8 @@ Jesse E. Lopez
 """
 import shutil
 
+import gr3_field
+
 
 #------------------------------------------------------------------------------
 # Functions
@@ -19,33 +21,8 @@ def make_salt_ic(old_file, new_file='salt.ic'):
     new_file - str
       path to new file
     """
-    with open(new_file, 'w') as outfile, open(old_file, 'r') as infile:
-        for i, line in enumerate(infile):
-            # Header
-            if i == 0:
-                outfile.write(line)
-            # Nodes and elems
-            elif i == 1:
-                outfile.write(line)
-                tmp = line.strip().split()
-                nnodes = int(tmp[1])
-                nelems = int(tmp[0])
-            # Adjust values for nodes
-            elif i > 1 and i < nnodes+2:
-                tmp = line.strip().split()
-                x = float(tmp[1])
-                y = float(tmp[2])
-                m = 30.0/50000.0
-                if x < 30000:
-                    salt = 30
-                elif x > 80000:
-                    salt = 0
-                else:
-                    salt = 30 - m*(x-30000)
-                outfile.write('%i  %f  %f  %f\n' % (i+1, x, y, salt))
-            # Write rest of the file
-            else:
-                outfile.write(line)
+    spec = 'x < 30000: 30; x > 80000: 0; else: 30 - m*(x-30000)'
+    gr3_field.write_field_gr3(old_file, new_file, spec, {'m': 30.0/50000.0})
 
 
 #------------------------------------------------------------------------------
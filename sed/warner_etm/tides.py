@@ -0,0 +1 @@
+../../selfe/tides.py
\ No newline at end of file
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Create .gr3 property files for many run directories from one hgrid.gr3.
+
+The runs are described by a CSV parameter matrix.  The first column is the
+run directory, every other column is an output file and each cell is a
+gr3_field spec (a constant, an expression or a piecewise spec):
+
+    run,drag.gr3,rough.gr3,salt.ic
+    run01,0.0025,0.0005,x < 30000: 30; x > 80000: 0; else: 30 - 6e-4*(x-30000)
+    run02,0.0050,0.0010,x < 30000: 30; x > 80000: 0; else: 30 - 6e-4*(x-30000)
+
+Unless --no-defaults is given, the constant files from make_gr3_files are
+also written to every run, with matrix columns taking precedence.
+
+hgrid.gr3 is parsed once and the files are written by a forked process
+pool, so workers share the grid copy-on-write instead of re-parsing it.
+
+Example:
+    ./batch_gr3_files.py runs.csv -g hgrid.gr3 -n 16
+
+Jesse E. Lopez
+"""
+import csv
+import multiprocessing
+import os
+import time
+
+import gr3
+import gr3_field
+import make_gr3_files
+
+# Grid shared with forked workers
+_GRID = None
+
+
+#------------------------------------------------------------------------------
+# Functions
+#------------------------------------------------------------------------------
+def read_matrix(path):
+    """Read parameter matrix and return list of (run_dir, {file: spec})."""
+    runs = []
+    with open(path, 'rb') as f:
+        reader = csv.reader(f, skipinitialspace=True)
+        header = [h.strip() for h in reader.next()]
+        for row in reader:
+            if not row or row[0].strip().startswith('#'):
+                continue
+            specs = dict((h, v.strip()) for h, v in zip(header[1:], row[1:])
+                         if v.strip())
+            runs.append((row[0].strip(), specs))
+    return runs
+
+
+def make_tasks(runs, defaults=True):
+    """Return list of (path, spec) for every file of every run."""
+    tasks = []
+    for run_dir, specs in runs:
+        files = {}
+        if defaults:
+            files.update((f, repr(v)) for f, v in make_gr3_files.VALUES.items())
+        files.update(specs)
+        tasks.extend((os.path.join(run_dir, f), s)
+                     for f, s in sorted(files.items()))
+    return tasks
+
+
+def _write_task(task):
+    """Pool worker, write one .gr3 file from the inherited grid."""
+    path, spec = task
+    t0 = time.time()
+    gr3.write_gr3(path, _GRID, gr3_field.make_field(spec))
+    return path, time.time() - t0
+
+
+def batch_gr3_files(matrix, hgrid='hgrid.gr3', nprocs=None, defaults=True):
+    """Create the .gr3 files of every run in the parameter matrix.
+
+    Params:
+    -------
+    matrix - str
+        path to CSV parameter matrix
+    hgrid - str
+        path to reference .gr3 file shared by all runs
+    nprocs - int, optional
+        number of worker processes, defaults to number of cores
+    defaults - bool
+        also write make_gr3_files.VALUES to every run
+    """
+    global _GRID
+    runs = read_matrix(matrix)
+    tasks = make_tasks(runs, defaults)
+    for run_dir, _ in runs:
+        if not os.path.isdir(run_dir):
+            os.makedirs(run_dir)
+
+    print 'Reading %s' % hgrid
+    _GRID = gr3.load_gr3(hgrid)
+    print 'Writing %d files for %d runs' % (len(tasks), len(runs))
+    t0 = time.time()
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        for path, secs in pool.imap_unordered(_write_task, tasks):
+            print '- %s (%.2f s)' % (path, secs)
+    finally:
+        pool.close()
+        pool.join()
+        _GRID = None
+    print 'Done in %.2f s' % (time.time() - t0)
+
+
+#------------------------------------------------------------------------------
+# Main
+#------------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('matrix', type=str, help='CSV parameter matrix.')
+    parser.add_argument('-g', '--hgrid', type=str, default='hgrid.gr3',
+                        help='Reference .gr3 file.')
+    parser.add_argument('-n', '--nprocs', type=int,
+                        help='Number of worker processes.')
+    parser.add_argument('--no-defaults', dest='defaults', action='store_false',
+                        default=True,
+                        help='Only write files listed in the matrix.')
+    args = parser.parse_args()
+
+    batch_gr3_files(args.matrix, args.hgrid, args.nprocs, args.defaults)
+
+if __name__ == '__main__':
+    main()
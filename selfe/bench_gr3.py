@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Benchmark the gr3 preprocessing tools on synthetic meshes.
+
+For each mesh size a structured triangular mesh is written to a scratch
+directory, then every tool is run in a fresh interpreter so that peak RSS
+is per tool.  Inside the child gr3.read_gr3 and gr3.write_gr3 are wrapped
+with timers, splitting the run into:
+    parse     - reading the text .gr3
+    cache     - writing the .npz cache sidecar
+    transform - evaluating the tool's field (inside write_gr3)
+    write     - formatting and writing the new .gr3, minus transform
+
+create_gr3_files writes from a process pool, so only its total is timed.
+
+Example:
+    ./bench_gr3.py -s 10000 100000 1000000 -o bench.csv
+
+Jesse E. Lopez
+"""
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import gr3
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+SIZES = [10000, 100000, 1000000, 10000000]
+TOOLS = ['make_const_gr3', 'apply_slope_gr3', 'load_depth_trench',
+         'make_salt_ic', 'gr3_field', 'create_gr3_files']
+PHASES = ['parse', 'cache', 'transform', 'write']
+# Channel length, matches the Warner test case the tools were written for
+LENGTH = 120000.0
+WIDTH = 1000.0
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def make_mesh(nnodes):
+    """Return a structured triangular channel mesh with about nnodes nodes."""
+    ny = max(int(np.sqrt(nnodes*WIDTH/LENGTH)), 2)
+    nx = max(nnodes // ny, 2)
+    x, y = np.meshgrid(np.linspace(0, LENGTH, nx), np.linspace(0, WIDTH, ny))
+    x = x.ravel()
+    y = y.ravel()
+    depth = 10 - 5e-5*x
+
+    # Two triangles per cell, 1-based node ids
+    ll = (np.arange(ny - 1)[:, None]*nx + np.arange(nx - 1)[None, :]).ravel()
+    ll = ll + 1
+    lr = ll + 1
+    ul = ll + nx
+    ur = ul + 1
+    elems = np.empty((2*ll.shape[0], 3), dtype=np.int64)
+    elems[0::2] = np.column_stack((ll, lr, ur))
+    elems[1::2] = np.column_stack((ll, ur, ul))
+    nv = np.empty((elems.shape[0],), dtype=np.int64)
+    nv.fill(3)
+
+    return gr3.Gr3('synthetic %d nodes\n' % x.shape[0], x, y, depth, elems, nv)
+
+
+def _timed(func, phase, times):
+    """Wrap func so its run time is added to times[phase]."""
+    def wrapper(*args, **kwargs):
+        t0 = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            times[phase] += time.time() - t0
+    return wrapper
+
+
+def _instrument(times):
+    """Wrap gr3 functions and callable values with phase timers."""
+    write_gr3 = gr3.write_gr3
+
+    def timed_write(path, grid, values=None, *args, **kwargs):
+        if callable(values):
+            values = _timed(values, 'transform', times)
+        t0 = time.time()
+        transform = times['transform']
+        write_gr3(path, grid, values, *args, **kwargs)
+        times['write'] += (time.time() - t0) - (times['transform'] - transform)
+
+    gr3.read_gr3 = _timed(gr3.read_gr3, 'parse', times)
+    gr3.write_cache = _timed(gr3.write_cache, 'cache', times)
+    gr3.write_gr3 = timed_write
+
+
+def run_tool(tool, hgrid):
+    """Run one tool on hgrid in the current process, return result dict."""
+    times = dict((p, 0.0) for p in PHASES)
+    _instrument(times)
+
+    t0 = time.time()
+    if tool == 'make_const_gr3':
+        import make_gr3_files
+        make_gr3_files.make_const_gr3(hgrid, 'const.gr3', 0.0025)
+    elif tool == 'apply_slope_gr3':
+        import apply_slope_gr3
+        apply_slope_gr3.load_warner(hgrid, 'slope.gr3')
+    elif tool == 'load_depth_trench':
+        import load_depth_trench
+        load_depth_trench.load_warner(hgrid, 'trench.gr3')
+    elif tool == 'make_salt_ic':
+        sys.path.append(os.path.join(os.path.dirname(__file__), '..',
+                                     'sed', 'warner_etm'))
+        import make_salt_ic
+        make_salt_ic.make_salt_ic(hgrid, 'salt.ic')
+    elif tool == 'gr3_field':
+        import gr3_field
+        gr3_field.write_field_gr3(hgrid, 'field.gr3',
+                                  'x < 5e4: 0.0025; else: 0.001 + 1e-8*x')
+    elif tool == 'create_gr3_files':
+        import make_gr3_files
+        make_gr3_files.create_gr3_files(hgrid)
+    else:
+        raise ValueError('Unknown tool: %s' % tool)
+    times['total'] = time.time() - t0
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kB on Linux
+    times['rss_mb'] = max(self_rss, child_rss)/1024.0
+    return times
+
+
+def bench(sizes=SIZES, tools=TOOLS, keep=False):
+    """Run all tools on meshes of each size, return list of result dicts."""
+    results = []
+    for size in sizes:
+        work = tempfile.mkdtemp(prefix='bench_gr3_')
+        try:
+            hgrid = os.path.join(work, 'hgrid.gr3')
+            grid = make_mesh(size)
+            gr3.write_gr3(hgrid, grid)
+            nnodes = grid.nnodes
+            del grid
+            for tool in tools:
+                # Fresh interpreter and no cache, so RSS and parse are per tool
+                if os.path.exists(gr3.cache_path(hgrid)):
+                    os.remove(gr3.cache_path(hgrid))
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--run', tool, hgrid], cwd=work)
+                res = json.loads(out.strip().split('\n')[-1])
+                res.update({'tool': tool, 'nodes': nnodes,
+                            'nodes_per_s': nnodes/max(res['total'], 1e-9)})
+                results.append(res)
+                print_result(res)
+        finally:
+            if keep:
+                print 'Kept %s' % work
+            else:
+                shutil.rmtree(work)
+    return results
+
+
+def print_header():
+    print '%-18s %10s %8s %8s %9s %8s %8s %12s %9s' % (
+        'tool', 'nodes', 'parse', 'cache', 'transform', 'write', 'total',
+        'nodes/s', 'RSS [MB]')
+
+
+def print_result(r):
+    print '%-18s %10d %8.3f %8.3f %9.3f %8.3f %8.3f %12.0f %9.1f' % (
+        r['tool'], r['nodes'], r['parse'], r['cache'], r['transform'],
+        r['write'], r['total'], r['nodes_per_s'], r['rss_mb'])
+
+
+def write_csv(path, results):
+    """Append results to a CSV file, writing a header for new files."""
+    cols = ['tool', 'nodes'] + PHASES + ['total', 'nodes_per_s', 'rss_mb']
+    new = not os.path.exists(path)
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a') as f:
+        if new:
+            f.write('date,' + ','.join(cols) + '\n')
+        for r in results:
+            f.write(stamp + ',' + ','.join(str(r[c]) for c in cols) + '\n')
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES,
+                        help='Mesh sizes in nodes.')
+    parser.add_argument('-t', '--tools', nargs='+', default=TOOLS,
+                        choices=TOOLS, help='Tools to benchmark.')
+    parser.add_argument('-o', '--csv', type=str,
+                        help='Append results to this CSV file.')
+    parser.add_argument('-k', '--keep', action='store_true', default=False,
+                        help='Keep scratch directories.')
+    parser.add_argument('--run', nargs=2, metavar=('TOOL', 'HGRID'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # Child process, report as one JSON line on stdout
+        sys.stdout = open(os.devnull, 'w')
+        res = run_tool(*args.run)
+        sys.stdout = sys.__stdout__
+        print json.dumps(res)
+        return
+
+    print_header()
+    results = bench(args.sizes, args.tools, args.keep)
+    if args.csv:
+        write_csv(args.csv, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""Validate a .gr3 file or compare two of them (e.g. drag.gr3 vs hgrid.gr3).
+
+Both files are streamed chunk by chunk, so memory use does not depend on
+mesh size.  Checks:
+    - node and element counts, node ids, element node ids and values
+    - node and element blocks holding as many lines as the counts declare
+    - with a second file, node coordinates (within --atol) and element
+      tables, plus value differences (only an error with --values)
+
+Exits with status 1 if any check fails, so it can gate job submission.
+
+Example:
+    ./compare_gr3.py drag.gr3 hgrid.gr3
+    ./compare_gr3.py salt.ic
+
+Jesse E. Lopez
+"""
+import sys
+
+import numpy as np
+
+import gr3
+
+# Number of mismatched ranges printed per check
+MAX_RANGES = 10
+
+
+#------------------------------------------------------------------------------
+# Functions
+#------------------------------------------------------------------------------
+def bad_ranges(bad, offset=0):
+    """Return list of inclusive 1-based (first, last) runs where bad is True.
+
+    Params:
+    -------
+    bad - np.array of bool
+        mismatch flag per row of a chunk
+    offset - int
+        0-based index of the first row of the chunk
+    """
+    edges = np.diff(np.concatenate(([0], bad.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0] + offset + 1
+    stops = np.nonzero(edges == -1)[0] + offset
+    return zip(starts, stops)
+
+
+def _add_ranges(ranges, new):
+    """Append new runs to ranges, merging runs that touch across chunks."""
+    for first, last in new:
+        if ranges and ranges[-1][1] + 1 == first:
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((first, last))
+
+
+def _new_check():
+    return {'count': 0, 'max': 0.0, 'ranges': []}
+
+
+def _update(check, bad, offset, diff=None):
+    """Accumulate mismatch count, max difference and ranges of a chunk."""
+    check['count'] += int(bad.sum())
+    if diff is not None and diff.size:
+        check['max'] = max(check['max'], float(np.nanmax(diff)))
+    _add_ranges(check['ranges'], bad_ranges(bad, offset))
+
+
+def _read_block(read, f, n, path, report):
+    """Return read(f, n), recording a short block of path in report."""
+    try:
+        return read(f, n)
+    except gr3.ShortBlockError as e:
+        report['short_blocks'].append('%s: %s' % (path, e))
+        raise
+
+
+def compare_gr3(file_a, file_b=None, atol=1e-6, values=False, vtol=0.0,
+                chunk=gr3.CHUNK_ROWS):
+    """Validate file_a and compare it to file_b, return report dict.
+
+    Params:
+    -------
+    file_a - str
+        path to .gr3 file to check
+    file_b - str, optional
+        path to reference .gr3 file, e.g. hgrid.gr3
+    atol - float
+        tolerance of coordinate differences
+    values - bool
+        treat 4th column differences larger than vtol as mismatches
+    vtol - float
+        tolerance of 4th column differences
+    chunk - int
+        rows read from each file at a time
+
+    Returns:
+    --------
+    report - dict
+        'errors' list of str and one check dict per comparison
+    """
+    report = {'errors': [], 'node_ids': _new_check(),
+              'elem_ids': _new_check(), 'nonfinite': _new_check(),
+              'coords': _new_check(), 'values': _new_check(),
+              'elems': _new_check(), 'short_blocks': [],
+              'min': np.inf, 'max': -np.inf}
+    fa = gr3.open_gr3(file_a)
+    fb = gr3.open_gr3(file_b) if file_b else None
+    start = 0
+    try:
+        _, nelems, nnodes = gr3.read_counts(fa)
+        report['nnodes'] = nnodes
+        report['nelems'] = nelems
+        if fb:
+            _, nelems_b, nnodes_b = gr3.read_counts(fb)
+            if (nelems, nnodes) != (nelems_b, nnodes_b):
+                report['errors'].append(
+                    'counts differ: %d nodes %d elems vs %d nodes %d elems'
+                    % (nnodes, nelems, nnodes_b, nelems_b))
+                fb.close()
+                fb = None
+
+        for start in xrange(0, nnodes, chunk):
+            n = min(chunk, nnodes - start)
+            a = _read_block(gr3.read_nodes, fa, n, file_a, report)
+            ids = np.arange(start + 1, start + n + 1)
+            _update(report['node_ids'], a[:, 0] != ids, start)
+            finite = np.isfinite(a[:, 1:]).all(axis=1)
+            _update(report['nonfinite'], ~finite, start)
+            if finite.any():
+                report['min'] = min(report['min'], a[finite, 3].min())
+                report['max'] = max(report['max'], a[finite, 3].max())
+            if fb:
+                b = _read_block(gr3.read_nodes, fb, n, file_b, report)
+                dxy = np.abs(a[:, 1:3] - b[:, 1:3]).max(axis=1)
+                _update(report['coords'], ~(dxy <= atol), start, dxy)
+                dv = np.abs(a[:, 3] - b[:, 3])
+                _update(report['values'], ~(dv <= vtol), start, dv)
+
+        for start in xrange(0, nelems, chunk):
+            n = min(chunk, nelems - start)
+            ea, nva = _read_block(gr3.read_elems, fa, n, file_a, report)
+            bad = ((nva < 3) | (nva > 4) |
+                   (ea > nnodes).any(axis=1) | (ea == 0).any(axis=1) |
+                   (ea < -1).any(axis=1))
+            for k in range(ea.shape[1]):
+                bad |= (k < nva) & (ea[:, k] == -1)
+            _update(report['elem_ids'], bad, start)
+            if fb:
+                eb, nvb = _read_block(gr3.read_elems, fb, n, file_b,
+                                      report)
+                width = max(ea.shape[1], eb.shape[1])
+                pa = np.pad(ea, ((0, 0), (0, width - ea.shape[1])),
+                            'constant', constant_values=-1)
+                pb = np.pad(eb, ((0, 0), (0, width - eb.shape[1])),
+                            'constant', constant_values=-1)
+                _update(report['elems'], (pa != pb).any(axis=1), start)
+    except gr3.ShortBlockError:
+        # Recorded by _read_block, nothing after the block can be compared
+        pass
+    except ValueError as e:
+        report['errors'].append('%s (near row %d)' % (e, start + 1))
+    finally:
+        fa.close()
+        if fb:
+            fb.close()
+
+    checks = ['node_ids', 'elem_ids', 'nonfinite']
+    if file_b:
+        checks += ['coords', 'elems']
+        if values:
+            checks.append('values')
+    for c in checks:
+        if report[c]['count']:
+            report['errors'].append('%s: %d mismatched rows'
+                                    % (c, report[c]['count']))
+    for short in report['short_blocks']:
+        report['errors'].append('short_blocks: %s' % short)
+    return report
+
+
+def print_report(report, file_a, file_b=None):
+    """Print a compare_gr3 report."""
+    print 'File      : %s' % file_a
+    if file_b:
+        print 'Reference : %s' % file_b
+    print 'Nodes     : %d' % report.get('nnodes', 0)
+    print 'Elements  : %d' % report.get('nelems', 0)
+    if report['min'] <= report['max']:
+        print 'Values    : %g to %g' % (report['min'], report['max'])
+    if file_b:
+        print 'Max |dxy| : %g' % report['coords']['max']
+        print 'Max |dval|: %g' % report['values']['max']
+    for name in ['node_ids', 'elem_ids', 'nonfinite', 'coords', 'values',
+                 'elems']:
+        check = report[name]
+        if not check['count']:
+            continue
+        ranges = ', '.join('%d-%d' % r for r in check['ranges'][:MAX_RANGES])
+        if len(check['ranges']) > MAX_RANGES:
+            ranges += ', ...'
+        print '%-10s: %d rows differ in %s' % (name, check['count'], ranges)
+    if report['errors']:
+        print 'FAILED'
+        for e in report['errors']:
+            print '- %s' % e
+    else:
+        print 'OK'
+
+
+#------------------------------------------------------------------------------
+# Main
+#------------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('gr3_file', type=str, help='.gr3 file to check.')
+    parser.add_argument('ref_file', type=str, nargs='?',
+                        help='Reference .gr3 file, e.g. hgrid.gr3.')
+    parser.add_argument('-a', '--atol', type=float, default=1e-6,
+                        help='Coordinate tolerance.')
+    parser.add_argument('-v', '--values', action='store_true', default=False,
+                        help='Fail on 4th column differences.')
+    parser.add_argument('--vtol', type=float, default=0.0,
+                        help='4th column tolerance with --values.')
+    parser.add_argument('-c', '--chunk', type=int, default=gr3.CHUNK_ROWS,
+                        help='Rows read at a time.')
+    args = parser.parse_args()
+
+    report = compare_gr3(args.gr3_file, args.ref_file, args.atol,
+                         args.values, args.vtol, args.chunk)
+    print_report(report, args.gr3_file, args.ref_file)
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
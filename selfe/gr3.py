@@ -0,0 +1,592 @@
+"""Read and write SELFE .gr3 files (hgrid.gr3, drag.gr3, salt.ic, etc.).
+
+Nodes and element connectivity are parsed in bulk into NumPy arrays and
+written back in bulk, so per-node property files can be made with array
+expressions instead of line-by-line loops.
+
+Parsed grids are cached next to the source as <file>.npz and reused by
+load_gr3 until the source file's mtime or size changes.  For meshes that do
+not fit in memory, open_store converts the file once to a directory of
+memory-mapped arrays (<file>.mmap/) and write_gr3 accepts a callable that
+is evaluated on one chunk of nodes at a time.
+
+Files ending in .gz or .zst are compressed and decompressed transparently
+(zstd needs the zstandard package).  Writing to a .nc path exports the
+grid and node values as a UGRID NetCDF file instead of text.
+
+Example:
+    import gr3
+    grid = gr3.load_gr3('hgrid.gr3')
+    gr3.write_gr3('drag.gr3', grid, 0.0025 + 1e-5*grid.x)
+
+    grid = gr3.open_store('hgrid.gr3')
+    gr3.write_gr3('drag.gr3', grid, lambda x, y, depth: 0.0025 + 1e-5*x)
+
+    gr3.write_gr3('drag.gr3.gz', grid, 0.0025)
+    gr3.write_ugrid('props.nc', grid, {'drag': 0.0025, 'rough': 5e-4})
+
+Jesse E. Lopez
+"""
+import gzip
+import io
+import itertools
+import os
+import zipfile
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+NODE_FMT = '%i  %f  %f  %f\n'
+CACHE_EXT = '.npz'
+STORE_EXT = '.mmap'
+ZSTD_LEVEL = 3
+# Rows formatted per write call, keeps string size bounded for large meshes
+CHUNK_ROWS = 200000
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class ShortBlockError(ValueError):
+    """A node or element block has fewer lines than the counts declare."""
+
+
+class Gr3(object):
+    """Node table and element connectivity of a .gr3 file.
+
+    Attributes:
+    -----------
+    header - str
+        first line of the file
+    x, y, depth - np.array (nnodes,)
+        node coordinates and 4th column values
+    elems - np.array (nelems, 3) or (nelems, 4)
+        1-based node ids of each element, -1 pads triangles in mixed meshes
+    nv - np.array (nelems,)
+        number of nodes in each element
+    tail - str
+        everything after the element table (boundary info), kept verbatim
+    """
+    def __init__(self, header, x, y, depth, elems, nv, tail=''):
+        self.header = header
+        self.x = x
+        self.y = y
+        self.depth = depth
+        self.elems = elems
+        self.nv = nv
+        self.tail = tail
+
+    @property
+    def nnodes(self):
+        return self.x.shape[0]
+
+    @property
+    def nelems(self):
+        return self.elems.shape[0]
+
+
+class _ZstdReader(io.BufferedReader):
+    """Line-iterable reader of a zstd file that also closes the file."""
+    def __init__(self, path):
+        import zstandard
+        self._fh = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(self._fh)
+        io.BufferedReader.__init__(self, reader)
+
+    def close(self):
+        io.BufferedReader.close(self)
+        self._fh.close()
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def open_gr3(path, mode='r'):
+    """Open a text .gr3 file, (de)compressing .gz and .zst by extension.
+
+    Params:
+    -------
+    path - str
+        path to file
+    mode - str
+        'r' or 'w'
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+    if path.endswith('.zst'):
+        if mode == 'r':
+            return _ZstdReader(path)
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return cctx.stream_writer(open(path, 'wb'))
+    return open(path, mode)
+
+
+def read_counts(f):
+    """Read header and element/node counts from the top of open file f.
+
+    Returns:
+    --------
+    header - str
+    nelems, nnodes - int
+    """
+    header = f.readline()
+    tmp = f.readline().split()
+    return header, int(tmp[0]), int(tmp[1])
+
+
+def read_nodes(f, nrows):
+    """Read the next nrows node lines of open file f as (nrows, 4) array."""
+    lines = list(itertools.islice(f, nrows))
+    if len(lines) != nrows:
+        raise ShortBlockError('expected %d node lines, read %d'
+                              % (nrows, len(lines)))
+    nodes = np.fromstring(''.join(lines), sep=' ')
+    if nodes.size != nrows*4:
+        raise ValueError('expected %d node lines, read %d values'
+                         % (nrows, nodes.size))
+    return nodes.reshape((nrows, 4))
+
+
+def read_elems(f, nrows):
+    """Read the next nrows element lines of open file f.
+
+    Returns:
+    --------
+    elems - np.array (nrows, 3) or (nrows, 4)
+        1-based node ids, -1 pads triangles in mixed blocks
+    nv - np.array (nrows,)
+        number of nodes in each element
+    """
+    lines = list(itertools.islice(f, nrows))
+    if len(lines) != nrows:
+        raise ShortBlockError('expected %d element lines, read %d'
+                              % (nrows, len(lines)))
+    data = np.fromstring(''.join(lines), sep=' ')
+    # Fast path, triangles only
+    if data.size == nrows*5 and np.all(data[1::5] == 3):
+        data = data.reshape((nrows, 5)).astype(np.int64)
+        return data[:, 2:], data[:, 1]
+
+    # Mixed triangles and quads
+    nv = np.zeros((nrows,), dtype=np.int64)
+    elems = np.empty((nrows, 4), dtype=np.int64)
+    elems.fill(-1)
+    for i, line in enumerate(lines):
+        tmp = line.split()
+        nv[i] = int(tmp[1])
+        elems[i, :nv[i]] = [int(n) for n in tmp[2:2+nv[i]]]
+    return elems, nv
+
+
+def read_gr3(path):
+    """Read and return a .gr3 file as a Gr3.
+
+    Params:
+    -------
+    path - str
+        path to .gr3 file, optionally .gz/.zst compressed, or a UGRID .nc
+        file with a single node variable
+    """
+    if path.endswith('.nc'):
+        grid, fields = read_ugrid(path)
+        if len(fields) != 1:
+            raise ValueError('%s has %d node variables, use read_ugrid'
+                             % (path, len(fields)))
+        grid.depth = fields.values()[0]
+        return grid
+
+    with open_gr3(path, 'r') as f:
+        try:
+            header, nelems, nnodes = read_counts(f)
+            nodes = read_nodes(f, nnodes)
+            elems, nv = read_elems(f, nelems)
+        except ValueError as e:
+            raise type(e)('%s: %s' % (path, e))
+        tail = ''.join(f)
+
+    return Gr3(header, nodes[:, 1].copy(), nodes[:, 2].copy(),
+               nodes[:, 3].copy(), elems, nv, tail)
+
+
+def cache_path(path):
+    """Return path of the binary cache sidecar for a .gr3 file."""
+    return path + CACHE_EXT
+
+
+def _source_stamp(path):
+    """Return (mtime, size) identifying the current version of path."""
+    st = os.stat(path)
+    return np.array([st.st_mtime, st.st_size], dtype=np.float64)
+
+
+def read_cache(path):
+    """Return Gr3 from the cache of path, or None if missing or stale.
+
+    Params:
+    -------
+    path - str
+        path to source .gr3 file
+    """
+    cache = cache_path(path)
+    # A truncated .npz is not even a zip, skip np.load's noisy failure
+    if not os.path.exists(cache) or not zipfile.is_zipfile(cache):
+        return None
+    try:
+        with np.load(cache) as data:
+            if not np.array_equal(data['stamp'], _source_stamp(path)):
+                return None
+            return Gr3(str(data['header']), data['x'], data['y'],
+                       data['depth'], data['elems'], data['nv'],
+                       str(data['tail']))
+    except Exception:
+        # Truncated or corrupt cache (e.g. BadZipfile), re-parse the source
+        return None
+
+
+def write_cache(path, grid):
+    """Write grid to the cache sidecar of path.
+
+    The cache is written to a temporary file and renamed into place so
+    concurrent readers never see a partial file.  Failure to write (e.g.
+    read-only directory) is not an error, the grid is just not cached.
+    """
+    cache = cache_path(path)
+    tmp = '%s.%d.tmp' % (cache, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, stamp=_source_stamp(path), header=grid.header,
+                     x=grid.x, y=grid.y, depth=grid.depth, elems=grid.elems,
+                     nv=grid.nv, tail=grid.tail)
+        os.rename(tmp, cache)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_gr3(path, cache=True):
+    """Read and return a .gr3 file as a Gr3, using the binary cache.
+
+    Params:
+    -------
+    path - str
+        path to .gr3 file
+    cache - bool
+        use and refresh the <path>.npz sidecar, otherwise always parse
+    """
+    if not cache:
+        return read_gr3(path)
+    grid = read_cache(path)
+    if grid is None:
+        grid = read_gr3(path)
+        write_cache(path, grid)
+    return grid
+
+
+def write_rows(f, fmt, data, chunk=CHUNK_ROWS):
+    """Write 2D array to open file f, formatting chunk rows per write.
+
+    Params:
+    -------
+    f - file
+        open file to write to
+    fmt - str
+        format of one row, including the newline
+    data - np.array (nrows, ncols)
+        values to write
+    """
+    for start in xrange(0, data.shape[0], chunk):
+        block = data[start:start+chunk]
+        f.write((fmt*block.shape[0]) % tuple(block.ravel()))
+
+
+def _node_values(values, grid, start, stop):
+    """Return 4th column values for nodes start:stop."""
+    if values is None:
+        return grid.depth[start:stop]
+    if callable(values):
+        return values(grid.x[start:stop], grid.y[start:stop],
+                      grid.depth[start:stop])
+    if np.ndim(values) == 0:
+        return values
+    return values[start:stop]
+
+
+def write_gr3(path, grid, values=None, header=None, chunk=CHUNK_ROWS):
+    """Write a .gr3 file using the nodes and elements of grid.
+
+    Nodes and elements are formatted chunk rows at a time, so memory use is
+    bounded when grid is a memory-mapped store.
+
+    Params:
+    -------
+    path - str
+        path to new .gr3 file
+    grid - Gr3
+        grid providing node coordinates and elements
+    values - float, np.array (nnodes,) or callable, optional
+        new 4th column, defaults to grid.depth.  A callable is evaluated
+        as values(x, y, depth) on each chunk of nodes.
+    header - str, optional
+        first line of the file, defaults to grid.header
+
+    Notes:
+    ------
+    - .gz and .zst paths are compressed, .nc paths are written with
+      write_ugrid using the file name as the variable name.
+    """
+    if path.endswith('.nc'):
+        name = os.path.basename(path)[:-3].split('.')[0]
+        write_ugrid(path, grid, {name: values}, header, chunk)
+        return
+
+    if header is None:
+        header = grid.header
+    if not header.endswith('\n'):
+        header = header + '\n'
+
+    with open_gr3(path, 'w') as f:
+        f.write(header)
+        f.write('%d %d\n' % (grid.nelems, grid.nnodes))
+        for start in xrange(0, grid.nnodes, chunk):
+            stop = min(start + chunk, grid.nnodes)
+            nodes = np.empty((stop - start, 4))
+            nodes[:, 0] = np.arange(start+1, stop+1)
+            nodes[:, 1] = grid.x[start:stop]
+            nodes[:, 2] = grid.y[start:stop]
+            nodes[:, 3] = _node_values(values, grid, start, stop)
+            write_rows(f, NODE_FMT, nodes, chunk)
+        _write_elems(f, grid, chunk)
+        f.write(grid.tail)
+
+
+def _write_elems(f, grid, chunk=CHUNK_ROWS):
+    """Write element table of grid to open file f."""
+    fmts = np.array(['%i %i' + ' %i'*n + '\n' for n in range(5)])
+    for start in xrange(0, grid.nelems, chunk):
+        stop = min(start + chunk, grid.nelems)
+        nv = np.asarray(grid.nv[start:stop])
+        rows = np.empty((stop - start, 2 + grid.elems.shape[1]),
+                        dtype=np.int64)
+        rows[:, 0] = np.arange(start+1, stop+1)
+        rows[:, 1] = nv
+        rows[:, 2:] = grid.elems[start:stop]
+        if np.all(nv == nv[0]):
+            write_rows(f, fmts[nv[0]], rows[:, :2+nv[0]], chunk)
+        else:
+            # Mixed triangles and quads, drop the -1 padding
+            f.write(''.join(fmts[nv]) % tuple(rows[rows != -1]))
+
+
+# -----------------------------------------------------------------------------
+# UGRID NetCDF
+# -----------------------------------------------------------------------------
+def write_ugrid(path, grid, fields, header=None, chunk=CHUNK_ROWS):
+    """Write grid and node fields to a UGRID-1.0 NetCDF file.
+
+    Params:
+    -------
+    path - str
+        path to new .nc file
+    grid - Gr3
+        grid providing node coordinates and elements
+    fields - dict
+        variable name -> float, np.array (nnodes,) or callable as in
+        write_gr3 (None writes grid.depth)
+    header - str, optional
+        stored as the title attribute, defaults to grid.header
+    """
+    import netCDF4 as nc
+
+    if header is None:
+        header = grid.header
+    nmax = grid.elems.shape[1]
+    out = nc.Dataset(path, 'w')
+    try:
+        out.Conventions = 'CF-1.6, UGRID-1.0'
+        out.title = header.strip()
+        out.gr3_boundaries = grid.tail
+        out.createDimension('nMesh2_node', grid.nnodes)
+        out.createDimension('nMesh2_face', grid.nelems)
+        out.createDimension('nMaxMesh2_face_nodes', nmax)
+
+        mesh = out.createVariable('Mesh2', 'i4')
+        mesh.cf_role = 'mesh_topology'
+        mesh.topology_dimension = 2
+        mesh.node_coordinates = 'Mesh2_node_x Mesh2_node_y'
+        mesh.face_node_connectivity = 'Mesh2_face_nodes'
+
+        x = out.createVariable('Mesh2_node_x', 'f8', ('nMesh2_node',))
+        y = out.createVariable('Mesh2_node_y', 'f8', ('nMesh2_node',))
+        faces = out.createVariable('Mesh2_face_nodes', 'i4',
+                                   ('nMesh2_face', 'nMaxMesh2_face_nodes'),
+                                   fill_value=-1)
+        faces.cf_role = 'face_node_connectivity'
+        faces.start_index = 1
+        nodes = {}
+        for name in fields:
+            nodes[name] = out.createVariable(name, 'f8', ('nMesh2_node',),
+                                             zlib=True)
+            nodes[name].mesh = 'Mesh2'
+            nodes[name].location = 'node'
+
+        for start in xrange(0, grid.nnodes, chunk):
+            stop = min(start + chunk, grid.nnodes)
+            x[start:stop] = grid.x[start:stop]
+            y[start:stop] = grid.y[start:stop]
+            for name, values in fields.items():
+                vals = _node_values(values, grid, start, stop)
+                nodes[name][start:stop] = np.broadcast_to(vals, (stop-start,))
+        for start in xrange(0, grid.nelems, chunk):
+            stop = min(start + chunk, grid.nelems)
+            faces[start:stop] = grid.elems[start:stop]
+    finally:
+        out.close()
+
+
+def read_ugrid(path):
+    """Read a UGRID file written by write_ugrid and return (grid, fields).
+
+    Params:
+    -------
+    path - str
+        path to .nc file
+
+    Returns:
+    --------
+    grid - Gr3
+        grid with zero depth
+    fields - dict
+        variable name -> np.array (nnodes,) of every node variable
+    """
+    import netCDF4 as nc
+
+    data = nc.Dataset(path)
+    try:
+        x = data.variables['Mesh2_node_x'][:]
+        y = data.variables['Mesh2_node_y'][:]
+        elems = np.ma.filled(data.variables['Mesh2_face_nodes'][:], -1)
+        elems = elems.astype(np.int64)
+        fields = {}
+        for name, var in data.variables.items():
+            if getattr(var, 'location', None) == 'node':
+                fields[name] = np.ma.filled(var[:], np.nan)
+        header = str(data.title) + '\n'
+        tail = str(getattr(data, 'gr3_boundaries', ''))
+    finally:
+        data.close()
+
+    nv = (elems != -1).sum(axis=1)
+    grid = Gr3(header, np.asarray(x), np.asarray(y), np.zeros_like(x),
+               elems, nv, tail)
+    return grid, fields
+
+
+# -----------------------------------------------------------------------------
+# Memory-mapped store
+# -----------------------------------------------------------------------------
+def store_path(path):
+    """Return path of the memory-mapped store directory for a .gr3 file."""
+    return path + STORE_EXT
+
+
+def build_store(path, chunk=CHUNK_ROWS):
+    """Convert a .gr3 file to a memory-mapped store, chunk rows at a time.
+
+    The store is a directory of .npy files (x, y, depth, elems, nv) plus
+    meta.npz with the header, boundary tail and source stamp.  Only chunk
+    rows of text are held in memory while building.
+
+    Params:
+    -------
+    path - str
+        path to source .gr3 file
+    """
+    store = store_path(path)
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    meta = os.path.join(store, 'meta.npz')
+    if os.path.exists(meta):
+        os.remove(meta)
+
+    def open_npy(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(store, name + '.npy'),
+                                         mode='w+', dtype=dtype, shape=shape)
+
+    with open_gr3(path, 'r') as f:
+        header, nelems, nnodes = read_counts(f)
+        x = open_npy('x', np.float64, (nnodes,))
+        y = open_npy('y', np.float64, (nnodes,))
+        depth = open_npy('depth', np.float64, (nnodes,))
+        for start in xrange(0, nnodes, chunk):
+            n = min(chunk, nnodes - start)
+            nodes = read_nodes(f, n)
+            x[start:start+n] = nodes[:, 1]
+            y[start:start+n] = nodes[:, 2]
+            depth[start:start+n] = nodes[:, 3]
+
+        elems = open_npy('elems', np.int32, (nelems, 4))
+        nv = open_npy('nv', np.int8, (nelems,))
+        for start in xrange(0, nelems, chunk):
+            n = min(chunk, nelems - start)
+            block, block_nv = read_elems(f, n)
+            elems[start:start+n, :block.shape[1]] = block
+            elems[start:start+n, block.shape[1]:] = -1
+            nv[start:start+n] = block_nv
+        tail = ''.join(f)
+
+    for a in (x, y, depth, elems, nv):
+        a.flush()
+    del x, y, depth, elems, nv
+    # Written last, marks the store as complete
+    np.savez(meta, stamp=_source_stamp(path), header=header, tail=tail)
+
+
+def open_store(path, mode='r'):
+    """Return a Gr3 whose arrays are memory-mapped from the store of path.
+
+    The store is (re)built from the source .gr3 if missing or stale.
+
+    Params:
+    -------
+    path - str
+        path to source .gr3 file
+    mode - str
+        np.load mmap_mode for the arrays, 'r' or 'r+'
+    """
+    store = store_path(path)
+    meta = os.path.join(store, 'meta.npz')
+    try:
+        with np.load(meta) as data:
+            fresh = np.array_equal(data['stamp'], _source_stamp(path))
+    except Exception:
+        # Missing, truncated or corrupt store, rebuild it
+        fresh = False
+    if not fresh:
+        build_store(path)
+
+    def load_npy(name):
+        return np.load(os.path.join(store, name + '.npy'), mmap_mode=mode)
+
+    with np.load(meta) as data:
+        header = str(data['header'])
+        tail = str(data['tail'])
+    return Gr3(header, load_npy('x'), load_npy('y'), load_npy('depth'),
+               load_npy('elems'), load_npy('nv'), tail)
+
+
+def iter_nodes(grid, chunk=CHUNK_ROWS):
+    """Yield (slice, x, y, depth) for consecutive chunks of nodes.
+
+    Params:
+    -------
+    grid - Gr3
+        in-memory or memory-mapped grid
+    chunk - int
+        number of nodes per chunk
+    """
+    for start in xrange(0, grid.nnodes, chunk):
+        ix = slice(start, min(start + chunk, grid.nnodes))
+        yield ix, grid.x[ix], grid.y[ix], grid.depth[ix]
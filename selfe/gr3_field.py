@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""Create .gr3 property files from a field expression of x, y and depth.
+
+A spec is either a single NumPy expression, e.g.
+
+    '0.39 + m*x'
+
+or a piecewise list of 'condition: expression' clauses ending with 'else',
+evaluated like if/elif/else, e.g.
+
+    'x <= 100000: 10 - x*m; else: 5'
+
+Expressions are compiled once and evaluated over whole arrays of nodes (or
+chunks of a memory-mapped store), never node by node.
+
+Example:
+    ./gr3_field.py hgrid.gr3 drag.gr3 'x < 5e4: 0.0025; else: 0.001'
+    ./gr3_field.py hgrid.gr3 slope.gr3 '10 - x*m' -p m=4e-4 --mmap
+
+Jesse E. Lopez
+"""
+import numpy as np
+
+import gr3
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+# Names available to expressions besides x, y, depth and user parameters
+NAMESPACE = {'__builtins__': {},
+             'np': np,
+             'pi': np.pi,
+             'abs': np.abs,
+             'exp': np.exp,
+             'log': np.log,
+             'log10': np.log10,
+             'sqrt': np.sqrt,
+             'sin': np.sin,
+             'cos': np.cos,
+             'tanh': np.tanh,
+             'minimum': np.minimum,
+             'maximum': np.maximum,
+             'clip': np.clip,
+             'where': np.where}
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def parse_spec(spec):
+    """Parse spec and return (clauses, default) as expression strings.
+
+    Params:
+    -------
+    spec - str
+        expression or 'cond: expr; ...; else: expr'
+
+    Returns:
+    --------
+    clauses - list of (cond, expr)
+        empty for a single expression
+    default - str
+        expression used where no condition holds
+    """
+    parts = [p.strip() for p in spec.split(';') if p.strip()]
+    if len(parts) == 1 and ':' not in parts[0]:
+        return [], parts[0]
+
+    clauses = []
+    default = None
+    for p in parts:
+        if ':' not in p:
+            raise ValueError('Clause missing \':\' in spec: %s' % p)
+        cond, expr = [s.strip() for s in p.split(':', 1)]
+        if cond == 'else':
+            default = expr
+        elif default is not None:
+            raise ValueError('Clause after else in spec: %s' % p)
+        else:
+            clauses.append((cond, expr))
+    if default is None:
+        raise ValueError('Piecewise spec needs an else clause: %s' % spec)
+
+    return clauses, default
+
+
+def make_field(spec, params=None):
+    """Return a function f(x, y, depth) evaluating spec over node arrays.
+
+    Params:
+    -------
+    spec - str
+        expression or piecewise spec, see module docstring
+    params - dict, optional
+        extra names available to the expressions, e.g. {'m': 4e-4}
+    """
+    clauses, default = parse_spec(spec)
+    conds = [compile(c, '<cond>', 'eval') for c, _ in clauses]
+    exprs = [compile(e, '<expr>', 'eval') for _, e in clauses]
+    default = compile(default, '<expr>', 'eval')
+
+    namespace = dict(NAMESPACE)
+    if params:
+        namespace.update(params)
+
+    def field(x, y, depth):
+        names = {'x': x, 'y': y, 'depth': depth}
+        vals = eval(default, namespace, names)
+        if not clauses:
+            return vals
+        # First true condition wins, as in if/elif/else
+        return np.select([eval(c, namespace, names) for c in conds],
+                         [eval(e, namespace, names) for e in exprs], vals)
+
+    return field
+
+
+def write_field_gr3(old_file, new_file, spec, params=None, mmap=False):
+    """Create new .gr3 file with 4th column given by a field spec.
+
+    Params:
+    -------
+    old_file - str
+        path to reference .gr3 file
+    new_file - str
+        path to new .gr3 file
+    spec - str
+        expression or piecewise spec of x, y and depth
+    params - dict, optional
+        extra names available to the expressions
+    mmap - bool
+        stream nodes from a memory-mapped store instead of loading the grid
+    """
+    field = make_field(spec, params)
+    if mmap:
+        grid = gr3.open_store(old_file)
+    else:
+        grid = gr3.load_gr3(old_file)
+    gr3.write_gr3(new_file, grid, field)
+
+
+def parse_params(params):
+    """Parse list of 'name=value' strings into a dict of floats."""
+    out = {}
+    for p in params or []:
+        name, val = p.split('=', 1)
+        out[name.strip()] = float(val)
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ref_file', type=str, help='Reference .gr3 file.')
+    parser.add_argument('new_file', type=str, help='New .gr3 file.')
+    parser.add_argument('spec', type=str,
+                        help='Expression or piecewise spec, e.g. '
+                             '\'x<=100000: 10 - x*m; else: 5\'')
+    parser.add_argument('-p', '--param', action='append',
+                        help='Parameter used in spec, e.g. m=4e-4')
+    parser.add_argument('--mmap', action='store_true', default=False,
+                        help='Stream nodes from a memory-mapped store.')
+    args = parser.parse_args()
+
+    write_field_gr3(args.ref_file, args.new_file, args.spec,
+                    parse_params(args.param), args.mmap)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""Set .gr3 property values inside polygons or near channel lines.
+
+Nodes are bucketed once into a uniform grid index, so a polygon or line
+query only tests the nodes in the buckets it overlaps instead of every node
+of the mesh against every polygon vertex.
+
+Polygons are read from ACE/xmgredit .reg files and lines from .bp files
+(or .reg).  Values are gr3_field specs, so they may depend on x, y and
+depth.  Regions are applied in the order given, later regions win (on the
+command line all -r polygons are applied before -n lines).
+
+Example:
+    ./gr3_region.py hgrid.gr3 drag.gr3 -b 0.0025 \\
+        -r shoal.reg 0.005 -n channel.bp 500 'where(depth > 10, 1e-3, 2e-3)'
+
+Jesse E. Lopez
+"""
+import numpy as np
+
+import gr3
+import gr3_field
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+# Target number of nodes per bucket
+NODES_PER_BUCKET = 16
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class GridIndex(object):
+    """Uniform grid-bucket spatial index over node coordinates.
+
+    Nodes are sorted by bucket id (row major), so the buckets of one row
+    of a bounding box are a single contiguous slice of the sorted nodes.
+    """
+    def __init__(self, x, y, nodes_per_bucket=NODES_PER_BUCKET):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        n = max(self.x.shape[0], 1)
+        self.xmin = self.x.min()
+        self.ymin = self.y.min()
+        w = self.x.max() - self.xmin
+        h = self.y.max() - self.ymin
+        # Square buckets holding ~nodes_per_bucket nodes, also for meshes
+        # that are (nearly) a line
+        self.size = max(np.sqrt(w*h*nodes_per_bucket/n),
+                        max(w, h)*nodes_per_bucket/n, 1e-12)
+        self.nx = int(w/self.size) + 1
+        self.ny = int(h/self.size) + 1
+
+        ix, iy = self._bucket(self.x, self.y)
+        bucket = iy*self.nx + ix
+        self.order = np.argsort(bucket, kind='mergesort')
+        self.start = np.searchsorted(bucket[self.order],
+                                     np.arange(self.nx*self.ny + 1))
+
+    def _bucket(self, x, y):
+        """Return bucket column and row of points, clipped to the index."""
+        ix = np.clip(((x - self.xmin)/self.size).astype(np.int64),
+                     0, self.nx - 1)
+        iy = np.clip(((y - self.ymin)/self.size).astype(np.int64),
+                     0, self.ny - 1)
+        return ix, iy
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        """Return indices of nodes inside the bounding box."""
+        (ix0, ix1), (iy0, iy1) = self._bucket(np.array([xmin, xmax]),
+                                              np.array([ymin, ymax]))
+        cand = [self.order[self.start[r*self.nx + ix0]:
+                           self.start[r*self.nx + ix1 + 1]]
+                for r in xrange(iy0, iy1 + 1)]
+        cand = np.concatenate(cand)
+        x = self.x[cand]
+        y = self.y[cand]
+        keep = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return np.sort(cand[keep])
+
+    def query_polygon(self, poly):
+        """Return indices of nodes inside polygon (npts, 2)."""
+        cand = self.query_bbox(poly[:, 0].min(), poly[:, 1].min(),
+                               poly[:, 0].max(), poly[:, 1].max())
+        inside = points_in_polygon(self.x[cand], self.y[cand], poly)
+        return cand[inside]
+
+    def query_line(self, line, dist):
+        """Return indices of nodes within dist of polyline (npts, 2)."""
+        near = []
+        for (x0, y0), (x1, y1) in zip(line[:-1], line[1:]):
+            cand = self.query_bbox(min(x0, x1) - dist, min(y0, y1) - dist,
+                                   max(x0, x1) + dist, max(y0, y1) + dist)
+            d = segment_distance(self.x[cand], self.y[cand], x0, y0, x1, y1)
+            near.append(cand[d <= dist])
+        if not near:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(near))
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def points_in_polygon(x, y, poly):
+    """Return boolean array of points inside polygon (even-odd rule).
+
+    Loops over polygon edges, each a vectorized test over all points.
+    """
+    inside = np.zeros(x.shape, dtype=bool)
+    xv = poly[:, 0]
+    yv = poly[:, 1]
+    j = len(poly) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in xrange(len(poly)):
+            crosses = (yv[i] > y) != (yv[j] > y)
+            xcross = (xv[j] - xv[i])*(y - yv[i])/(yv[j] - yv[i]) + xv[i]
+            inside ^= crosses & (x < xcross)
+            j = i
+    return inside
+
+
+def segment_distance(x, y, x0, y0, x1, y1):
+    """Return distance of points to the segment (x0, y0)-(x1, y1)."""
+    dx = x1 - x0
+    dy = y1 - y0
+    len2 = dx*dx + dy*dy
+    if len2 == 0:
+        t = np.zeros(x.shape)
+    else:
+        t = np.clip(((x - x0)*dx + (y - y0)*dy)/len2, 0, 1)
+    return np.hypot(x - (x0 + t*dx), y - (y0 + t*dy))
+
+
+def read_shape(path):
+    """Read polygon or line points from a .reg or .bp file as (npts, 2).
+
+    .reg (ACE) files have a comment line, the number of polygons (1), the
+    number of points and 'x y' per line.  .bp files have a comment line,
+    the number of points and 'id x y z' per line.
+    """
+    with open(path) as f:
+        lines = f.readlines()
+    if path.endswith('.bp'):
+        npts = int(lines[1].split()[0])
+        data = np.fromstring(''.join(lines[2:2+npts]), sep=' ')
+        return data.reshape((npts, -1))[:, 1:3]
+
+    npts = int(lines[2].split()[0])
+    data = np.fromstring(''.join(lines[3:3+npts]), sep=' ')
+    return data.reshape((npts, -1))[:, :2]
+
+
+def assign_regions(grid, values, regions, index=None):
+    """Return values with region specs applied to the nodes they cover.
+
+    Params:
+    -------
+    grid - gr3.Gr3
+        grid providing node coordinates and depth
+    values - np.array (nnodes,)
+        base values, not modified
+    regions - list
+        ('polygon', poly, spec) or ('line', line, dist, spec) tuples,
+        applied in order, spec is a gr3_field spec or number
+    index - GridIndex, optional
+        index of grid nodes, built if not given
+    """
+    if index is None:
+        index = GridIndex(grid.x, grid.y)
+    values = np.array(np.broadcast_to(values, (grid.nnodes,)),
+                      dtype=np.float64)
+    for region in regions:
+        if region[0] == 'polygon':
+            ix = index.query_polygon(region[1])
+        elif region[0] == 'line':
+            ix = index.query_line(region[1], region[2])
+        else:
+            raise ValueError('Unknown region type: %s' % region[0])
+        field = gr3_field.make_field(str(region[-1]))
+        vals = field(grid.x[ix], grid.y[ix], grid.depth[ix])
+        values[ix] = np.broadcast_to(vals, ix.shape)
+        print '- %s region: %d nodes' % (region[0], ix.shape[0])
+    return values
+
+
+def make_region_gr3(old_file, new_file, base, regions):
+    """Create new .gr3 file from a base spec and region specs.
+
+    Params:
+    -------
+    old_file - str
+        path to reference .gr3 file
+    new_file - str
+        path to new .gr3 file
+    base - str
+        gr3_field spec for nodes outside all regions
+    regions - list
+        see assign_regions
+    """
+    grid = gr3.load_gr3(old_file)
+    values = gr3_field.make_field(base)(grid.x, grid.y, grid.depth)
+    values = assign_regions(grid, values, regions)
+    gr3.write_gr3(new_file, grid, values)
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('ref_file', type=str, help='Reference .gr3 file.')
+    parser.add_argument('new_file', type=str, help='New .gr3 file.')
+    parser.add_argument('-b', '--base', type=str, default='depth',
+                        help='Spec outside regions, defaults to ref values.')
+    parser.add_argument('-r', '--region', nargs=2, action='append',
+                        default=[], metavar=('REG', 'SPEC'),
+                        help='Polygon file and spec inside it.')
+    parser.add_argument('-n', '--near', nargs=3, action='append', default=[],
+                        metavar=('LINE', 'DIST', 'SPEC'),
+                        help='Line file, distance and spec near it.')
+    args = parser.parse_args()
+
+    regions = [('polygon', read_shape(f), s) for f, s in args.region]
+    regions += [('line', read_shape(f), float(d), s)
+                for f, d, s in args.near]
+    make_region_gr3(args.ref_file, args.new_file, args.base, regions)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,52 @@
 #!/usr/bin/env python
 
+import itertools
+import os
+
 import netCDF4 as nc
 import numpy as np
-import struct
 
-from data import selfeGridUtils as sgu
+import th
+import vgrid
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+# Size of the block of frames written at a time
+CHUNK_BYTES = 64*1024*1024
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class CachedVerticalCoordinates(object):
+    """vgrid.in parsed once per version of the file.
+
+    Drop-in for selfeGridUtils.verticalCoordinates.  The grid is read by
+    vgrid.read_vgrid, whose level tables evaluate Z for whole eta and dp
+    arrays in one vectorized call, so one parsed grid serves every
+    boundary node and time step.
+    """
+    _files = {}
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    @classmethod
+    def fromVGridFile(cls, path):
+        """Return the instance for path, parsing it only if new or changed."""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime, st.st_size)
+        if key not in cls._files:
+            cls._files[key] = cls(vgrid.read_vgrid(path))
+        return cls._files[key]
+
+    def computeVerticalCoordinates(self, eta, dp):
+        """Return Z (nvrt, n), kbp (n,), iwet (n,) for elevations and depths.
+
+        eta and dp are broadcast against each other and flattened.
+        """
+        return self.grid.computeVerticalCoordinates(eta, dp)
 
 
 # -----------------------------------------------------------------------------
@@ -30,8 +72,10 @@ def calc_velocity_profile(dav, z0, Z, depth):
     return u
 
 
-def load_velocity_profile(dav, z0, nvrt, vgrid_path, eta=0, dp=10.0):
-    vgrid = sgu.verticalCoordinates.fromVGridFile(vgrid_path)
+def load_velocity_profile(dav, z0, nvrt, vgrid_path, eta=0, dp=10.0,
+                          vgrid=None, verbose=True):
+    if vgrid is None:
+        vgrid = CachedVerticalCoordinates.fromVGridFile(vgrid_path)
     Z, kbp2, iwet = vgrid.computeVerticalCoordinates(np.array([eta]), np.array([dp]))
     # need depths to be height from the bottom
     Z = dp + Z
@@ -46,6 +90,9 @@ def load_velocity_profile(dav, z0, nvrt, vgrid_path, eta=0, dp=10.0):
     Z = Z[::-1, 0]
     #u = u[::-1, 0]
 
+    if not verbose:
+        return u, v, Z
+
     print 'Above bottom[m]\t\tU [m/s]\t\tdz'
     dz = np.diff(Z)
     for i in range(Z.shape[0]):
@@ -72,45 +119,202 @@ def plot_profile(u, Z):
 
 
 def pack_data(nnodes, nvrt, u, v):
-    # Dump data into buffer
-    # nvrt*nnodes*u*2 (doubles are 2 floats)
-    # nvrt*nnodes*v*2
-    # 1 time is a float
-    size = nvrt*nnodes*2 + 1
-    out = np.empty((size,), dtype='f')
-    ix = 0
-    for n in range(nnodes):
-        for k in range(nvrt):
-            ix = ix + 4
-            struct.pack_into('f', out, ix, u[k])
-            ix = ix + 4
-            struct.pack_into('f', out, ix, v[k])
+    """Return one uv3D.th frame as a float32 buffer.
+
+    Layout is [time, u(1,1), v(1,1), u(1,2), v(1,2), ... u(n,nvrt), v(n,nvrt)]
+    with levels varying fastest.  The time slot is left 0 for write_uv3D.
+
+    Params:
+    -------
+    nnodes - int
+        number of boundary nodes
+    nvrt - int
+        number of vertical levels
+    u, v - np.array (nvrt,) or (nnodes, nvrt)
+        velocity profile used at every node, or one profile per node
+    """
+    out = np.zeros((nvrt*nnodes*2 + 1,), dtype='f')
+    frame = out[1:].reshape((nnodes, nvrt, 2))
+    frame[:, :, 0] = np.reshape(u, (-1, nvrt))
+    frame[:, :, 1] = np.reshape(v, (-1, nvrt))
 
     return out
 
 
-def write_uv3D(out, ntimesteps, dt):
-    # Write the file
-    print 'Writing file uv3D.th'
-    f = open('uv3D.th', 'wb')
-    for t in range(1, ntimesteps+1):
-        # Update time
-        struct.pack_into('f', out, 0, t*dt)
-        # Fortran record length
-        # f.write(struct.pack('i', size))
-        f.write(out)
-        # Fortran record length
-        # f.write(struct.pack('i', size))
-    f.close()
+def pack_scalar(nnodes, nvrt, s):
+    """Return one salt3D.th/temp3D.th frame as a float32 buffer.
+
+    Layout is [time, s(1,1), s(1,2), ... s(n,nvrt)] with levels varying
+    fastest.  The time slot is left 0 for write_uv3D.
+
+    Params:
+    -------
+    s - float, np.array (nvrt,) or (nnodes, nvrt)
+        value at every node and level, one profile, or one per node
+    """
+    out = np.zeros((nvrt*nnodes + 1,), dtype='f')
+    frame = out[1:].reshape((nnodes, nvrt))
+    if np.ndim(s):
+        frame[:] = np.reshape(s, (-1, nvrt))
+    else:
+        frame[:] = s
+
+    return out
+
+
+def _th_format(fname):
+    """Return the th backend of a 3D file, NetCDF for .nc, else binary."""
+    return 'netcdf' if fname.endswith('.nc') else 'binary'
+
 
+def write_uv3D(out, ntimesteps, dt, fname='uv3D.th', chunk_bytes=CHUNK_BYTES,
+               layout='stream', dtype=th.DTYPE, shape=None):
+    """Write frame out for times dt, 2*dt, ... ntimesteps*dt to fname.
 
-def create_uv3D_file(vgrid_path, nnodes, nvrt, nts, dt, dav, z0, depth):
+    A block of identical frames is filled once and each block is written
+    with only its times updated (th.ThWriter.write_constant), so the cost
+    is bounded by disk bandwidth rather than one Python write per time
+    step.
+
+    Params:
+    -------
+    out - np.array float32
+        frame from pack_data or pack_scalar, the time slot is ignored
+    ntimesteps - int
+        number of frames
+    dt - float
+        time step [s]
+    layout - str
+        'stream' or 'record' (Fortran record markers), see th.frame_dtype
+    dtype - str
+        value dtype with byte order
+    shape - tuple, optional
+        (nnodes, nvrt, ncomp) of the frame, used for .nc output
+    """
+    print 'Writing file %s' % fname
+    nvalues = out.shape[0] - 1
+    size = th.frame_dtype(nvalues, dtype, layout).itemsize
+    nframes = int(max(1, min(ntimesteps, chunk_bytes // size)))
+    with th.ThWriter(fname, shape or (nvalues,), _th_format(fname), dtype,
+                     layout) as w:
+        for start in xrange(0, ntimesteps, nframes):
+            n = min(nframes, ntimesteps - start)
+            w.write_constant(dt*np.arange(start+1, start+n+1), out[1:])
+
+
+def write_uv3D_frames(frames, nnodes, nvrt, ntimesteps, dt, fname='uv3D.th',
+                      chunk_bytes=CHUNK_BYTES, layout='stream', dtype=th.DTYPE):
+    """Write time-varying frames to fname through a bounded block buffer.
+
+    Params:
+    -------
+    frames - iterable
+        yields (u, v) for each time step, each (nvrt,) or (nnodes, nvrt)
+    nnodes - int
+        number of boundary nodes
+    nvrt - int
+        number of vertical levels
+    ntimesteps - int
+        number of frames to write, frames must yield at least this many
+    dt - float
+        time step [s], frame i is written with time (i+1)*dt
+    layout, dtype
+        see write_uv3D
+    """
+    print 'Writing file %s' % fname
+    size = th.frame_dtype(nvrt*nnodes*2, dtype, layout).itemsize
+    nframes = int(max(1, min(ntimesteps, chunk_bytes // size)))
+    times = np.empty((nframes,))
+    uv = np.empty((nframes, nnodes, nvrt, 2),
+                  dtype=np.dtype(dtype).newbyteorder('='))
+
+    written = 0
+    with th.ThWriter(fname, (nnodes, nvrt, 2), _th_format(fname), dtype,
+                     layout) as w:
+        for u, v in itertools.islice(frames, ntimesteps):
+            n = written % nframes
+            times[n] = (written+1)*dt
+            uv[n, :, :, 0] = np.reshape(u, (-1, nvrt))
+            uv[n, :, :, 1] = np.reshape(v, (-1, nvrt))
+            written += 1
+            if n == nframes - 1:
+                w.write(times, uv)
+        if written % nframes:
+            w.write(times[:written % nframes], uv[:written % nframes])
+
+    if written != ntimesteps:
+        raise ValueError('frames ended after %d of %d time steps'
+                         % (written, ntimesteps))
+
+
+def callable_frames(func, ntimesteps, dt):
+    """Yield func(t) for t = dt, 2*dt, ... ntimesteps*dt.
+
+    func returns (u, v) for time t [s], each (nvrt,) or (nnodes, nvrt).
+    """
+    for i in xrange(1, ntimesteps+1):
+        yield func(i*dt)
+
+
+def netcdf_frames(nc_path, uvar='u', vvar='v', block=100):
+    """Yield (u, v) per time from NetCDF variables shaped (time, ...).
+
+    Reads block time steps at a time.  If vvar is not in the file v is 0.
+    """
+    data = nc.Dataset(nc_path)
+    try:
+        u = data.variables[uvar]
+        v = data.variables.get(vvar)
+        for start in xrange(0, u.shape[0], block):
+            ub = np.ma.filled(u[start:start+block], 0.0)
+            if v is None:
+                vb = np.zeros_like(ub)
+            else:
+                vb = np.ma.filled(v[start:start+block], 0.0)
+            for i in xrange(ub.shape[0]):
+                yield ub[i], vb[i]
+    finally:
+        data.close()
+
+
+def tidal_modulation(u, v, period, amp=0.0, mean=1.0, phase=0.0, ramp=0.0):
+    """Return func(t) scaling profile (u, v) by a ramped tidal signal.
+
+    Scale is r(t)*(mean + amp*cos(2*pi*t/period - phase)) where r ramps
+    linearly from 0 to 1 over ramp seconds.
+    """
+    omega = 2*np.pi/period
+
+    def func(t):
+        scale = mean + amp*np.cos(omega*t - phase)
+        if ramp > 0:
+            scale = scale*min(t/ramp, 1.0)
+        return u*scale, v*scale
+
+    return func
+
+
+def create_uv3D_file(vgrid_path, nnodes, nvrt, nts, dt, dav, z0, depth,
+                     layout='stream', dtype=th.DTYPE):
     """Writes logrithmic velocity profile to all nodes for all times."""
     eta = 0.0
     u, v, d = load_velocity_profile(dav, z0, nvrt, vgrid_path, dp=depth)
     plot_profile(u, d)
     buf_out = pack_data(nnodes, nvrt, u, v)
-    write_uv3D(buf_out, nts, dt)
+    write_uv3D(buf_out, nts, dt, layout=layout, dtype=dtype,
+               shape=(nnodes, nvrt, 2))
+
+
+def create_tidal_uv3D_file(vgrid_path, nnodes, nvrt, nts, dt, dav, z0, depth,
+                           period, amp=0.0, mean=1.0, ramp=0.0,
+                           layout='stream', dtype=th.DTYPE):
+    """Writes log profile modulated by a ramped tide to all nodes."""
+    u, v, d = load_velocity_profile(dav, z0, nvrt, vgrid_path, dp=depth)
+    plot_profile(u, d)
+    func = tidal_modulation(np.ravel(u), np.ravel(v), period, amp, mean,
+                            ramp=ramp)
+    write_uv3D_frames(callable_frames(func, nts, dt), nnodes, nvrt, nts, dt,
+                      layout=layout, dtype=dtype)
 
 
 # -----------------------------------------------------------------------------
@@ -127,11 +331,30 @@ def parsecli():
     parser.add_argument('z0', type=float, help='Bottom roughness length [m]')
     parser.add_argument('depth', type=float, help='Depth at boundary')
     parser.add_argument('vgrid', help='vgrid.in path')
+    parser.add_argument('--period', type=float,
+                        help='Tidal period [s], enables time-varying output')
+    parser.add_argument('--amp', type=float, default=0.0,
+                        help='Tidal amplitude as a fraction of dav')
+    parser.add_argument('--mean', type=float, default=1.0,
+                        help='Mean flow as a fraction of dav')
+    parser.add_argument('--ramp', type=float, default=0.0,
+                        help='Ramp up time [days]')
+    parser.add_argument('--layout', choices=th.LAYOUTS, default='stream',
+                        help='Frame layout, record adds Fortran markers')
+    parser.add_argument('--dtype', default=th.DTYPE,
+                        help='Value dtype with byte order, e.g. >f4')
     args = parser.parse_args()
 
     nts = int(args.ndays*86400/args.dt)
-    create_uv3D_file(args.vgrid, args.nnodes, args.nvrt, nts, args.dt,
-                     args.dav, args.z0, args.depth)
+    if args.period:
+        create_tidal_uv3D_file(args.vgrid, args.nnodes, args.nvrt, nts,
+                               args.dt, args.dav, args.z0, args.depth,
+                               args.period, args.amp, args.mean,
+                               args.ramp*86400, args.layout, args.dtype)
+    else:
+        create_uv3D_file(args.vgrid, args.nnodes, args.nvrt, nts, args.dt,
+                         args.dav, args.z0, args.depth, args.layout,
+                         args.dtype)
 
 
 if __name__ == '__main__':
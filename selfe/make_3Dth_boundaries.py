@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""Create uv3D.th, salt3D.th and temp3D.th for several open boundaries.
+
+Boundaries are listed in a CSV file, one per row:
+
+    name,nnodes,depth,dav,z0,salt,temp
+    ocean,120,25.0,0.4,0.005,32.0,10.0
+    river,12,8.0,-0.8,0.005,0.0,12.0
+
+Files for boundary <name> are written to <outdir>/<name>/.  An empty salt
+or temp cell skips that file.  vgrid.in is parsed once and shared with the
+forked worker processes, which write all files of all boundaries
+concurrently and report their throughput.
+
+Example:
+    ./make_3Dth_boundaries.py boundaries.csv vgrid.in 21 100 15 -o bnd
+
+Jesse E. Lopez
+"""
+import csv
+import multiprocessing
+import os
+import time
+
+import make_3Dth
+
+# Vertical grid shared with forked workers
+_VGRID = None
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def read_boundaries(path):
+    """Read boundary CSV file and return list of dicts."""
+    bnds = []
+    with open(path, 'rb') as f:
+        for row in csv.DictReader(f, skipinitialspace=True):
+            if not row['name'] or row['name'].startswith('#'):
+                continue
+            bnd = {'name': row['name'].strip(),
+                   'nnodes': int(row['nnodes'])}
+            for k in ['depth', 'dav', 'z0', 'salt', 'temp']:
+                val = (row.get(k) or '').strip()
+                bnd[k] = float(val) if val else None
+            bnds.append(bnd)
+    return bnds
+
+
+def make_tasks(bnds, outdir):
+    """Return list of (boundary, kind, path) for every file to write."""
+    tasks = []
+    for bnd in bnds:
+        bnd_dir = os.path.join(outdir, bnd['name'])
+        if bnd['dav'] is not None:
+            tasks.append((bnd, 'uv', os.path.join(bnd_dir, 'uv3D.th')))
+        if bnd['salt'] is not None:
+            tasks.append((bnd, 'salt', os.path.join(bnd_dir, 'salt3D.th')))
+        if bnd['temp'] is not None:
+            tasks.append((bnd, 'temp', os.path.join(bnd_dir, 'temp3D.th')))
+    return tasks
+
+
+def _write_task(args):
+    """Pool worker, write one 3D .th file using the inherited vgrid."""
+    (bnd, kind, path), nvrt, nts, dt = args
+    t0 = time.time()
+    if kind == 'uv':
+        u, v, _ = make_3Dth.load_velocity_profile(
+            bnd['dav'], bnd['z0'], nvrt, None, dp=bnd['depth'],
+            vgrid=_VGRID, verbose=False)
+        out = make_3Dth.pack_data(bnd['nnodes'], nvrt, u, v)
+        ncomp = 2
+    else:
+        out = make_3Dth.pack_scalar(bnd['nnodes'], nvrt, bnd[kind])
+        ncomp = 1
+    make_3Dth.write_uv3D(out, nts, dt, path,
+                         shape=(bnd['nnodes'], nvrt, ncomp))
+    return path, out.nbytes*nts, time.time() - t0
+
+
+def create_boundary_files(bnd_file, vgrid_path, nvrt, nts, dt, outdir='.',
+                          nprocs=None):
+    """Write 3D .th files of all boundaries in bnd_file concurrently.
+
+    Params:
+    -------
+    bnd_file - str
+        path to boundary CSV file
+    vgrid_path - str
+        path to vgrid.in, parsed once
+    nvrt - int
+        number of vertical levels
+    nts - int
+        number of time steps
+    dt - float
+        time step [s]
+    outdir - str
+        directory holding one sub directory per boundary
+    nprocs - int, optional
+        number of worker processes, defaults to number of cores
+    """
+    global _VGRID
+    bnds = read_boundaries(bnd_file)
+    tasks = make_tasks(bnds, outdir)
+    for bnd in bnds:
+        bnd_dir = os.path.join(outdir, bnd['name'])
+        if not os.path.isdir(bnd_dir):
+            os.makedirs(bnd_dir)
+
+    _VGRID = make_3Dth.CachedVerticalCoordinates.fromVGridFile(vgrid_path)
+    print 'Writing %d files for %d boundaries' % (len(tasks), len(bnds))
+    t0 = time.time()
+    total = 0
+    pool = multiprocessing.Pool(nprocs)
+    try:
+        args = [(t, nvrt, nts, dt) for t in tasks]
+        for path, nbytes, secs in pool.imap_unordered(_write_task, args):
+            total += nbytes
+            print '- %s: %.1f MB in %.2f s (%.1f MB/s)' % (
+                path, nbytes/1e6, secs, nbytes/1e6/max(secs, 1e-9))
+    finally:
+        pool.close()
+        pool.join()
+        _VGRID = None
+    secs = time.time() - t0
+    print 'Total: %.1f MB in %.2f s (%.1f MB/s)' % (
+        total/1e6, secs, total/1e6/max(secs, 1e-9))
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def parsecli():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('boundaries', help='Boundary CSV file')
+    parser.add_argument('vgrid', help='vgrid.in path')
+    parser.add_argument('nvrt', type=int, help='Number vertical levels')
+    parser.add_argument('ndays', type=float, help='Number of days')
+    parser.add_argument('dt', type=float, help='Model time step')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='Output directory')
+    parser.add_argument('-n', '--nprocs', type=int,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+
+    nts = int(args.ndays*86400/args.dt)
+    create_boundary_files(args.boundaries, args.vgrid, args.nvrt, nts,
+                          args.dt, args.outdir, args.nprocs)
+
+
+if __name__ == '__main__':
+    parsecli()
@@ -3,7 +3,25 @@
 
 Jesse E. Lopez
 """
-import shutil
+import multiprocessing
+
+import gr3
+
+#------------------------------------------------------------------------------
+# Constants
+#------------------------------------------------------------------------------
+VALUES = {'diffmax.gr3': 1.0,
+          'diffmin.gr3': 1e-15,
+          'drag.gr3': 0.0088,
+          'interpol.gr3': 2.0,
+          'rough.gr3': 0.0005,
+          'tvd.gr3': 1.0,
+          'xlsc.gr3': 0.5,
+          'salt.ic': 0,
+          'temp.ic': 10}
+
+# Grid shared with forked writers
+_GRID = None
 
 #------------------------------------------------------------------------------
 # Functions
@@ -20,49 +38,52 @@ def make_const_gr3(old_file, new_file, val):
     val - float
         new value to write in 4th column
     """
-    with open(new_file, 'w') as outfile, open(old_file, 'r') as infile:
-        for i, line in enumerate(infile):
-            # Header
-            if i == 0:
-                outfile.write(line)
-            # Nodes and elems
-            elif i == 1:
-                outfile.write(line)
-                tmp = line.strip().split()
-                nnodes = int(tmp[1])
-                nelems = int(tmp[0])
-            # Adjust values for nodes
-            elif i > 1 and i < nnodes+2:
-                tmp = line.strip().split()
-                x = float(tmp[1])
-                y = float(tmp[2])
-                depth = float(tmp[3])
-                outfile.write('%i  %f  %f  %f\n' % (i+1, x, y, val))
-            # Write rest of the file
-            else:
-                outfile.write(line)
-
-
-def create_gr3_files():
-    values = {'diffmax.gr3': 1.0,
-              'diffmin.gr3': 1e-15,
-              'drag.gr3': 0.0088,
-              'interpol.gr3': 2.0,
-              'rough.gr3': 0.0005,
-              'tvd.gr3': 1.0,
-              'xlsc.gr3': 0.5,
-              'salt.ic': 0,
-              'temp.ic': 10}
-
-    for f in values.keys():
-        shutil.copy('hgrid.gr3', f)
-
-    for f, v in values.iteritems():
-        print 'Updating file %s' % f
-        make_const_gr3(f, f+'.new', v)
-
-    for f in values.keys():
-        shutil.move(f+'.new', f)
+    grid = gr3.load_gr3(old_file)
+    gr3.write_gr3(new_file, grid, val)
+
+
+def _write_const_gr3(args):
+    """Pool worker, write one constant .gr3 from the inherited grid."""
+    new_file, val = args
+    gr3.write_gr3(new_file, _GRID, val)
+    return new_file
+
+
+def write_const_gr3_files(grid, values, nprocs=None):
+    """Write a constant .gr3 file for each entry of values from one grid.
+
+    Params:
+    -------
+    grid - gr3.Gr3
+        parsed reference grid
+    values - dict
+        new file path -> value for 4th column
+    nprocs - int, optional
+        number of concurrent writers, defaults to number of cores
+
+    Notes:
+    ------
+    - Writers are forked, so the grid is shared copy-on-write rather than
+      pickled to each process.
+    """
+    global _GRID
+    _GRID = grid
+    pool = multiprocessing.Pool(min(nprocs or multiprocessing.cpu_count(),
+                                    len(values)))
+    try:
+        for f in pool.imap_unordered(_write_const_gr3, values.items()):
+            print 'Wrote file %s' % f
+    finally:
+        pool.close()
+        pool.join()
+        _GRID = None
+
+
+def create_gr3_files(hgrid='hgrid.gr3', nprocs=None):
+    """Create all constant .gr3 files from a single parse of hgrid."""
+    print 'Reading %s' % hgrid
+    grid = gr3.load_gr3(hgrid)
+    write_const_gr3_files(grid, VALUES, nprocs)
 
 
 #------------------------------------------------------------------------------
@@ -72,11 +93,13 @@ def main():
     import argparse
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('ref_file', type=str, help='Reference .gr3 file.')
-    parser.add_argument('new_file', type=str, help='New .gr3 file.')
+    parser.add_argument('-g', '--hgrid', type=str, default='hgrid.gr3',
+                        help='Reference .gr3 file.')
+    parser.add_argument('-n', '--nprocs', type=int,
+                        help='Number of concurrent writers.')
     args = parser.parse_args()
 
-    load_warner(args.ref_file, args.new_file)
+    create_gr3_files(args.hgrid, args.nprocs)
 
 if __name__ == '__main__':
-    create_gr3_files()
+    main()
@@ -1,36 +1,110 @@
 #!/usr/local/bin/python
-""" Creates a s-level only vgrid.in file for use with SELFE 
+""" Creates a vgrid.in file for use with SELFE
+
+    By default only creates s-levels and assumes the max depth is < 100m.
+    With -z, Z levels are added below h_s (SZ hybrid).  With --lsc2, a
+    SCHISM LSC2 grid with per-node levels is made from the depths of a
+    .gr3 file.
 
-    Only creates s-levels and assumes the max depth is < 100m.
-    
     Example:
-        ./make_vgrid.py 21 
+        ./make_vgrid.py 21
 
         Creats a vgrid.in.new file with 21 s levels
+
+        ./make_vgrid.py 21 --h_s 50 -z -500 -200 -100 -50
+        ./make_vgrid.py 41 --lsc2 hgrid.gr3 --dz 0.5
 """
-import sys
-
-
-def make_vgrid(numberOfLevels):
-    try:
-        vgrid = open('vgrid.in.new','w')
-        vgrid.write("%d 1 100\n" % numberOfLevels)
-        vgrid.write("Z levels\n")
-        vgrid.write("1 -100\n")
-        vgrid.write("S levels\n")
-        vgrid.write("7 1 10\n")
-        for i in range(1,numberOfLevels+1):
-            vgrid.write("%d %f\n"  % (i, -1+(i-1)*(1/(float(numberOfLevels)-1))))
-    except:
-        raise
-    finally:
-        vgrid.close()
+import time
+
+import gr3
+import vgrid
+
+
+def make_vgrid(numberOfLevels, path='vgrid.in.new', h_s=100.0, h_c=7.0,
+               theta_b=1.0, theta_f=10.0, ztot=None):
+    """Write an SZ vgrid.in with numberOfLevels S levels.
+
+    Params:
+    -------
+    numberOfLevels - int
+        number of S levels
+    path - str
+        path to new vgrid.in
+    h_s, h_c, theta_b, theta_f - float
+        S coordinate parameters
+    ztot - list of float, optional
+        Z levels bottom first, ending at -h_s, defaults to pure S
+    """
+    vg = vgrid.make_sz(numberOfLevels, h_s, h_c, theta_b, theta_f, ztot)
+    vgrid.write_vgrid(path, vg)
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        sys.exit("Usage: %s [number of S levels]" % sys.argv[0]); 
-    else:
-        nLevels = int(sys.argv[1])
 
-    make_vgrid(nLevels)
+def make_lsc2_vgrid(hgrid, nvrt, path='vgrid.in.new', dz=1.0, min_levels=2,
+                    theta_b=0.0, theta_f=0.0, layout='nodes'):
+    """Write an LSC2 vgrid.in for the nodes of hgrid.
 
+    Params:
+    -------
+    hgrid - str
+        path to .gr3 file providing node depths
+    nvrt - int
+        maximum number of levels
+    path - str
+        path to new vgrid.in
+    dz - float
+        target level spacing
+    min_levels - int
+        number of levels of the shallowest nodes
+    theta_b, theta_f - float
+        S coordinate stretching of each node's levels
+    layout - str
+        'nodes' or 'levels', see vgrid.write_vgrid
+    """
+    t0 = time.time()
+    grid = gr3.load_gr3(hgrid)
+    vg = vgrid.make_lsc2(grid.depth, nvrt, dz, min_levels, theta_b, theta_f)
+    vgrid.write_vgrid(path, vg, layout)
+    print 'Wrote %s for %d nodes in %.2f s' % (path, vg.nnodes,
+                                               time.time() - t0)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('levels', type=int,
+                        help='Number of S levels, or max levels with --lsc2.')
+    parser.add_argument('-o', '--output', default='vgrid.in.new',
+                        help='Output file.')
+    parser.add_argument('--h_s', type=float, default=100.0,
+                        help='Depth of transition from Z to S levels.')
+    parser.add_argument('--h_c', type=float, default=7.0,
+                        help='S coordinate critical depth.')
+    parser.add_argument('--theta_b', type=float,
+                        help='S coordinate bottom parameter.')
+    parser.add_argument('--theta_f', type=float,
+                        help='S coordinate surface parameter.')
+    parser.add_argument('-z', '--zlevels', type=float, nargs='+',
+                        help='Z levels bottom first, ending at -h_s.')
+    parser.add_argument('--lsc2', metavar='HGRID',
+                        help='Make LSC2 levels for the depths of HGRID.')
+    parser.add_argument('--dz', type=float, default=1.0,
+                        help='LSC2 target level spacing.')
+    parser.add_argument('--min-levels', type=int, default=2,
+                        help='LSC2 levels of the shallowest nodes.')
+    parser.add_argument('--layout', choices=['nodes', 'levels'],
+                        default='nodes', help='LSC2 file layout.')
+    args = parser.parse_args()
+
+    if args.lsc2:
+        make_lsc2_vgrid(args.lsc2, args.levels, args.output, args.dz,
+                        args.min_levels, args.theta_b or 0.0,
+                        args.theta_f or 0.0, args.layout)
+    else:
+        theta_b = 1.0 if args.theta_b is None else args.theta_b
+        theta_f = 10.0 if args.theta_f is None else args.theta_f
+        make_vgrid(args.levels, args.output, args.h_s, args.h_c, theta_b,
+                   theta_f, args.zlevels)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""Slice, time-shift, resample and concatenate existing .th files.
+
+Restarting a run from a hotstart or changing dt no longer needs the
+boundary files to be regenerated.  Inputs are read block by block (see
+th.iter_th) and passed through
+
+    concatenate -> slice [t0, t1] -> shift -> resample to dt -> write
+
+where every step works on whole (time, column) blocks, so all nodes,
+levels and components are handled with the same array operations and
+memory stays bounded by the block size.
+
+Concatenated files are joined in the given order, frames of a later file
+at or before the last time of the previous ones are dropped.  With
+--relative the times of each later file are counted from the end of the
+previous one, as written by a run continued from a hotstart.
+
+Resampling is linear or cubic Hermite with centred difference slopes
+(Catmull-Rom for equal spacing).  Output times are start + k*dt up to
+the last input time, start defaults to the first input time.  Blocks
+overlap by the frames the interpolation needs, so results do not depend
+on the block size.
+
+The output has the backend of the first input unless it is named *.nc,
+which writes SCHISM NetCDF starting at t = 0 (see th.py).  Binary and
+ASCII .th files start at the first time step, so frames at t <= 0 after
+shifting and resampling are dropped from them: the frame at the restart
+time kept by --t0 becomes t = 0 and the file starts at dt, as does a
+file converted from a NetCDF input.
+
+Example:
+    # Continue from a hotstart at day 10 with elev.th starting at dt
+    ./resample_th.py elev.th -o elev.th.new --t0 864000 --shift -864000
+    # Change dt of uv3D.th to 30 s with cubic interpolation
+    ./resample_th.py uv3D.th -o uv3D.th.new -n 120 --nvrt 21 -c 2 \\
+        --dt 30 --kind cubic
+    # Join two runs
+    ./resample_th.py flux.th run2/flux.th -o flux.th.new --relative
+
+Jesse E. Lopez
+"""
+import numpy as np
+
+import th
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+KINDS = ['linear', 'cubic']
+# Frames past the interval of an output time needed by each kind
+LOOKAHEAD = {'linear': 1, 'cubic': 2}
+# Values interpolated per output block, bounds the interpolation temporaries
+CHUNK_VALUES = 1000000
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def concat_blocks(streams, relative=False):
+    """Yield (times, values) blocks of several streams joined in order.
+
+    Params:
+    -------
+    streams - list of iterables
+        each yields (times, values) blocks in increasing time
+    relative - bool
+        count the times of every stream after the first from the last time
+        of the previous ones
+    """
+    last = None
+    for i, blocks in enumerate(streams):
+        offset = last if relative and i > 0 else 0.0
+        for times, values in blocks:
+            times = times + offset
+            if last is not None:
+                keep = times > last
+                if not keep.all():
+                    times = times[keep]
+                    values = values[keep]
+            if times.shape[0]:
+                last = times[-1]
+                yield times, values
+
+
+def slice_blocks(blocks, t0=None, t1=None):
+    """Yield the frames of blocks with t0 <= time <= t1."""
+    for times, values in blocks:
+        keep = np.ones(times.shape, dtype=bool)
+        if t0 is not None:
+            keep &= times >= t0
+        if t1 is not None:
+            keep &= times <= t1
+        if keep.any():
+            yield times[keep], values[keep]
+        if t1 is not None and times.shape[0] and times[-1] > t1:
+            break
+
+
+def after_blocks(blocks, t):
+    """Yield the frames of blocks later than t."""
+    for times, values in blocks:
+        if times.shape[0] and times[0] <= t:
+            keep = times > t
+            times = times[keep]
+            values = values[keep]
+        if times.shape[0]:
+            yield times, values
+
+
+def shift_blocks(blocks, shift):
+    """Yield blocks with shift [s] added to their times."""
+    for times, values in blocks:
+        yield times + shift, values
+
+
+def interpolate(times, values, t, kind='linear'):
+    """Return values (n, ...) interpolated at times t (n,).
+
+    times must bracket t, frames outside times are treated as the ends of
+    the series, with one sided slopes for cubic interpolation.
+
+    Params:
+    -------
+    times - np.array (nt,)
+        increasing frame times
+    values - np.array (nt, ...)
+        frames
+    t - np.array (n,)
+        output times, times[0] <= t <= times[-1]
+    kind - str
+        'linear' or 'cubic'
+    """
+    last = times.shape[0] - 1
+    i = np.clip(np.searchsorted(times, t, 'right') - 1, 0, max(last - 1, 0))
+    j = np.minimum(i + 1, last)
+    h = times[j] - times[i]
+    s = np.where(h > 0, (t - times[i])/np.where(h > 0, h, 1.0), 0.0)
+    # Weights broadcast over the columns of each frame
+    s = s.reshape(s.shape + (1,)*(values.ndim - 1))
+    if kind == 'linear':
+        return values[i] + s*(values[j] - values[i])
+
+    def slope(k):
+        lo = np.maximum(k - 1, 0)
+        hi = np.minimum(k + 1, last)
+        dt = (times[hi] - times[lo]).reshape(s.shape)
+        return (values[hi] - values[lo])/np.where(dt > 0, dt, 1.0)
+
+    h = h.reshape(s.shape)
+    s2 = s*s
+    s3 = s2*s
+    return ((2*s3 - 3*s2 + 1)*values[i] + (s3 - 2*s2 + s)*h*slope(i) +
+            (3*s2 - 2*s3)*values[j] + (s3 - s2)*h*slope(j))
+
+
+def resample_blocks(blocks, dt, start=None, kind='linear', chunk=None):
+    """Yield blocks of frames at times start, start + dt, ... by interpolation.
+
+    Input frames are buffered until every output time in them has all the
+    frames it needs, the last frames are kept for the next block.
+
+    Params:
+    -------
+    blocks - iterable
+        yields (times, values) blocks in increasing time
+    dt - float
+        output time step [s]
+    start - float, optional
+        first output time, defaults to the first input time
+    kind - str
+        'linear' or 'cubic'
+    chunk - int, optional
+        maximum number of output frames per block, defaults to CHUNK_VALUES
+        values
+    """
+    if kind not in KINDS:
+        raise ValueError('Unknown interpolation: %s' % kind)
+    ahead = LOOKAHEAD[kind]
+    buf_t = buf_v = None
+    k = 0
+    for times, values in blocks:
+        if buf_t is None:
+            buf_t, buf_v = times, values
+            if chunk is None:
+                chunk = max(1, CHUNK_VALUES // max(1, values[0].size))
+            if start is None:
+                start = times[0]
+            elif start < times[0]:
+                raise ValueError('start %g is before the first frame at %g'
+                                 % (start, times[0]))
+        else:
+            buf_t = np.concatenate((buf_t, times))
+            buf_v = np.concatenate((buf_v, values))
+        if buf_t.shape[0] <= ahead:
+            continue
+        # Output times before this one have all their frames
+        stop = buf_t[-ahead]
+        n = int(np.ceil((stop - start)/dt)) - k
+        for t, v in _interpolate_chunks(buf_t, buf_v, start, dt, k, n, kind,
+                                        chunk):
+            yield t, v
+        k += max(n, 0)
+        # Keep the frame before the next output time for cubic slopes
+        first = np.searchsorted(buf_t, start + k*dt, 'right') - 2
+        first = max(0, min(first, buf_t.shape[0] - ahead - 1))
+        buf_t = buf_t[first:]
+        buf_v = buf_v[first:]
+
+    if buf_t is None:
+        return
+    n = int(np.floor((buf_t[-1] - start)/dt + 1e-9)) + 1 - k
+    for t, v in _interpolate_chunks(buf_t, buf_v, start, dt, k, n, kind,
+                                    chunk):
+        yield t, v
+
+
+def _interpolate_chunks(times, values, start, dt, k, n, kind, chunk):
+    """Yield output frames k ... k+n-1 of times, values in chunks."""
+    for i in xrange(k, k + n, chunk):
+        t = start + dt*np.arange(i, min(i + chunk, k + n))
+        yield t, interpolate(times, values, t, kind)
+
+
+def _output_format(output, inputs):
+    """Return the output backend, NetCDF for .nc, else that of the inputs."""
+    if output.endswith('.nc'):
+        return 'netcdf'
+    fmt = th.sniff_format(inputs[0])
+    return 'binary' if fmt == 'netcdf' else fmt
+
+
+def resample_th(inputs, output, nnodes=None, nvrt=1, ncomp=1, t0=None,
+                t1=None, shift=0.0, dt=None, start=None, kind='linear',
+                relative=False, fmt=None, dtype=th.DTYPE, layout='stream',
+                ascii_fmt=th.ASCII_FMT, time_fmt=None):
+    """Write the frames of inputs, joined, sliced, shifted and resampled.
+
+    Params:
+    -------
+    inputs - list of str
+        paths to .th files in any backend, with the same frame shape
+    output - str
+        path to new .th file
+    nnodes, nvrt, ncomp - int
+        frame shape of binary inputs
+    t0, t1 - float, optional
+        first and last input time to keep, after joining
+    shift - float
+        added to the times after slicing [s]
+    dt - float, optional
+        output time step [s], frames are copied without one
+    start - float, optional
+        first output time of resampling, after shifting
+    kind - str
+        'linear' or 'cubic'
+    relative - bool
+        see concat_blocks
+    fmt - str, optional
+        output backend, NetCDF for a .nc output, else that of the first
+        input (binary for NetCDF inputs), frames at t <= 0 are dropped
+        from binary and ASCII output
+    dtype, layout, ascii_fmt, time_fmt
+        binary and ASCII number formats, see th.ThWriter
+    """
+    fmt = fmt or _output_format(output, inputs)
+    streams = [th.iter_th(p, nnodes, nvrt, ncomp, dtype=dtype)
+               for p in inputs]
+    blocks = concat_blocks(streams, relative)
+    if t0 is not None or t1 is not None:
+        blocks = slice_blocks(blocks, t0, t1)
+    if shift:
+        blocks = shift_blocks(blocks, shift)
+    if dt:
+        blocks = resample_blocks(blocks, dt, start, kind)
+    if fmt != 'netcdf':
+        # SELFE .th files start at dt, t = 0 is the (re)start state
+        blocks = after_blocks(blocks, 0.0)
+
+    print 'Writing %s' % output
+    writer = None
+    try:
+        for times, values in blocks:
+            if writer is None:
+                writer = th.ThWriter(output, values.shape[1:], fmt, dtype,
+                                     layout, ascii_fmt=ascii_fmt,
+                                     time_fmt=time_fmt)
+            writer.write(times, values)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError('No frames left to write to %s' % output)
+    print '- %d frames up to %g s' % (writer.nframes, times[-1])
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help='.th files to join.')
+    parser.add_argument('-o', '--output', required=True, help='Output file.')
+    parser.add_argument('-n', '--nnodes', type=int,
+                        help='Number of boundary nodes of binary files.')
+    parser.add_argument('--nvrt', type=int, default=1,
+                        help='Number of vertical levels of binary files.')
+    parser.add_argument('-c', '--ncomp', type=int, default=1,
+                        help='Values per node and level, 2 for uv3D.th.')
+    parser.add_argument('--t0', type=float,
+                        help='First time to keep [s], e.g. the restart time '
+                        'with --shift -t0 (frames at t <= 0 after shifting '
+                        'are dropped from binary and ASCII output).')
+    parser.add_argument('--t1', type=float, help='Last time to keep [s].')
+    parser.add_argument('-s', '--shift', type=float, default=0.0,
+                        help='Time added after slicing [s].')
+    parser.add_argument('--dt', type=float, help='Output time step [s].')
+    parser.add_argument('--start', type=float,
+                        help='First output time of --dt [s].')
+    parser.add_argument('-k', '--kind', choices=KINDS, default='linear',
+                        help='Interpolation of --dt.')
+    parser.add_argument('-r', '--relative', action='store_true',
+                        default=False,
+                        help='Later inputs count from the end of the previous.')
+    parser.add_argument('-f', '--format', choices=th.FORMATS,
+                        help='Output format, defaults to that of the inputs.')
+    parser.add_argument('-d', '--dtype', default=th.DTYPE,
+                        help='Binary dtype with byte order.')
+    parser.add_argument('--layout', choices=th.LAYOUTS, default='stream',
+                        help='Binary output frame layout.')
+    parser.add_argument('--ascii-fmt', default=th.ASCII_FMT,
+                        help='ASCII value format.')
+    parser.add_argument('--time-fmt', help='ASCII time format.')
+    args = parser.parse_args()
+
+    resample_th(args.inputs, args.output, args.nnodes, args.nvrt, args.ncomp,
+                args.t0, args.t1, args.shift, args.dt, args.start, args.kind,
+                args.relative, args.format, args.dtype, args.layout,
+                args.ascii_fmt, args.time_fmt)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,732 @@
+#!/usr/bin/env python
+"""Read, write and validate SELFE .th files (uv3D.th, elev.th, flux.th, ...).
+
+Time histories are frames of (node, level, component) values, one frame
+per time step, stored in one of three backends:
+    'ascii'  - 'time value ...' rows (elev.th, flux.th, htr_N.th)
+    'binary' - raw frames (uv3D.th, salt3D.th, elev2D.th), see below
+    'netcdf' - SCHISM *.th.nc, time and time_series(time, nOpenBndNodes,
+               nLevels, nComponents)
+The time axes differ: binary and ASCII files start at the first time
+step (dt, 2*dt, ...), while SCHISM reads record 1 of a *.th.nc file as
+t = 0 and steps from it by time_step.  ThWriter therefore starts every
+NetCDF file at t = 0, holding the first frame written back to it when
+that frame is later (its time must be a multiple of the time step), so
+the same generator output lines up in every backend.
+
+read_th returns a TimeHistory of any of them, memory-mapped for binary
+files and read as indexed for NetCDF.  ThWriter appends blocks of frames
+to any backend and write_th writes whole arrays through it, so every
+boundary generator shares the same bulk formatting and chunked output.
+
+A binary .th file holds one frame per time step, the time [s] followed by
+the values at all boundary nodes:
+
+    [time, v(1), v(2), ... v(nvalues)]
+
+For 3D files nvalues = nnodes*nvrt*ncomp, components varying fastest, then
+levels (see make_3Dth.pack_data).  Frames are either written back to back
+('stream') or as Fortran sequential unformatted records ('record'), where
+every frame is preceded and followed by its length in bytes.  Which layout
+a SELFE build reads depends on how its open statement was compiled, so the
+layout is always chosen explicitly and the dtype carries the endianness,
+e.g. '>f4' for big endian files.
+
+validate_th memory-maps a file and checks frame size, frame count, record
+markers and times, touching only the time and marker slots of each frame.
+Th3D exposes an existing 3D file as a memory-mapped (time, node, level,
+component) array, so a time window or the history of one node is read
+without loading the rest of the file.
+
+ASCII .th files (elev.th, flux.th, ...) have one 'time value ...' row per
+time step.  write_ascii_th formats rows a chunk at a time in one string
+operation, and write_ascii_th_blocks writes series produced block by block.
+iter_ascii_th reads them back a block of rows at a time, so long records
+never need to be in memory at once.
+
+Example:
+    th.write_th('elev2D.th.nc', times, eta)
+    elev = th.read_th('elev.th')
+    uv = th.read_th('uv3D.th', nnodes=120, nvrt=21, ncomp=2)
+
+    ./th.py uv3D.th 120 21 -c 2 --layout record -n 5760 --dt 15
+    ./th.py uv3D.th 120 21 -c 2 --node 60 -o node60.txt
+
+    uv = th.Th3D('uv3D.th', 120, 21)
+    u_bottom = uv.node(60)[:, 0, 0]
+    day2 = uv.window(86400, 2*86400)
+
+    th.write_ascii_th('elev.th', times, elev)
+
+Jesse E. Lopez
+"""
+import itertools
+import os
+import sys
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+DTYPE = '<f4'
+# Fortran record length marker
+MARKER = 'i4'
+LAYOUTS = ['stream', 'record']
+CHUNK_BYTES = 64*1024*1024
+# Rows formatted per write of ASCII files
+CHUNK_ROWS = 200000
+ASCII_FMT = '%f'
+FORMATS = ['ascii', 'binary', 'netcdf']
+# Bytes at the start of a file checked by sniff_format
+SNIFF_BYTES = 256
+ASCII_CHARS = '0123456789+-.eE \t\r\n'
+# Number of bad frames listed per check
+MAX_FRAMES = 10
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class TimeHistory(object):
+    """Frame times and (time, node, level, component) values.
+
+    values may be an array, a memory-mapped view or a NetCDF variable, the
+    latter two are only read as they are indexed.
+    """
+    def __init__(self, times, values, source=None):
+        self.times = times
+        self.values = values
+        self._source = source
+
+    @property
+    def nframes(self):
+        return self.values.shape[0]
+
+    @property
+    def nnodes(self):
+        return self.values.shape[1]
+
+    @property
+    def nvrt(self):
+        return self.values.shape[2]
+
+    @property
+    def ncomp(self):
+        return self.values.shape[3]
+
+    def node(self, i, start=0, stop=None):
+        """Return (ntimes, nvrt, ncomp) history of 0-based node i.
+
+        Only node i's slot of each frame in start:stop is read.
+        """
+        return np.array(self.values[start:stop, i])
+
+    def frame_range(self, t0=None, t1=None):
+        """Return (start, stop) of frames with t0 <= time <= t1."""
+        times = np.asarray(self.times)
+        start = 0 if t0 is None else np.searchsorted(times, t0, 'left')
+        stop = self.nframes if t1 is None else \
+            np.searchsorted(times, t1, 'right')
+        return int(start), int(stop)
+
+    def window(self, t0=None, t1=None):
+        """Return the lazy values view of frames with t0 <= time <= t1."""
+        start, stop = self.frame_range(t0, t1)
+        return self.values[start:stop]
+
+    def close(self):
+        """Close the underlying NetCDF file, if any."""
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+
+class Th3D(TimeHistory):
+    """Memory-mapped binary .th file as a TimeHistory.
+
+    values is a (time, node, level, component) view of the file and times
+    the frame times, both read lazily as they are indexed.
+    """
+    def __init__(self, path, nnodes, nvrt, ncomp=2, dtype=DTYPE, layout=None,
+                 mode='r'):
+        self.path = path
+        self.frames = open_th(path, nnodes*nvrt*ncomp, dtype, layout,
+                              mode=mode)
+        # Splitting the contiguous values axis keeps this a view
+        values = self.frames['values'].reshape(
+            (self.frames.shape[0], nnodes, nvrt, ncomp))
+        TimeHistory.__init__(self, self.frames['time'], values)
+
+
+class ThWriter(object):
+    """Append blocks of frames to a new .th file in any backend.
+
+    Params:
+    -------
+    path - str
+        path to new .th file
+    shape - tuple of int
+        (nnodes, nvrt, ncomp) of one frame, missing trailing sizes are 1,
+        ASCII rows take any number of columns
+    fmt - str, optional
+        'ascii', 'binary' or 'netcdf', see guess_format
+    dtype, layout, marker
+        binary frame type, see frame_dtype, dtype is also used for NetCDF
+    ascii_fmt, time_fmt - str
+        ASCII number formats, see format_rows
+    """
+    def __init__(self, path, shape=(1,), fmt=None, dtype=DTYPE,
+                 layout='stream', marker=MARKER, ascii_fmt=ASCII_FMT,
+                 time_fmt=None):
+        self.path = path
+        self.shape = tuple(shape) + (1,)*(3 - len(shape))
+        self.nvalues = int(np.prod(self.shape))
+        self.fmt = fmt or guess_format(path)
+        self.dtype = dtype
+        self.layout = layout
+        self.marker = marker
+        self.ascii_fmt = ascii_fmt
+        self.time_fmt = time_fmt
+        self.nframes = 0
+        self._frames = None
+        # Frame the binary block holds from write_constant, if any
+        self._const = None
+        if self.fmt == 'ascii':
+            self._f = open(path, 'w')
+        elif self.fmt == 'binary':
+            self._f = open(path, 'wb')
+        elif self.fmt == 'netcdf':
+            self._f = _create_nc_th(path, self.shape, dtype)
+        else:
+            raise ValueError('Unknown format: %s' % self.fmt)
+
+    def write(self, times, values):
+        """Append frames with times (n,) and values (n, ...)."""
+        times = np.atleast_1d(times)
+        n = times.shape[0]
+        values = np.reshape(values, (n, -1))
+        if self.fmt == 'ascii':
+            self._f.write(format_rows(times, values, self.ascii_fmt,
+                                      self.time_fmt))
+        elif self.fmt == 'binary':
+            if self._frames is None or self._frames.shape[0] < n:
+                self._frames = empty_frames(n, self.nvalues, self.dtype,
+                                            self.layout, self.marker)
+            frames = self._frames[:n]
+            frames['time'] = times
+            frames['values'] = values
+            frames.tofile(self._f)
+            self._const = None
+        else:
+            if self.nframes == 0 and times[0] > 0:
+                self._hold_first(times, values[0])
+            var = self._f.variables
+            var['time'][self.nframes:self.nframes+n] = times
+            var['time_series'][self.nframes:self.nframes+n] = \
+                values.reshape((n,) + self.shape)
+        self.nframes += n
+
+    def _hold_first(self, times, frame):
+        """Write frame at t = 0, step, ... up to the first time of times.
+
+        Record 1 of a *.th.nc file is read as t = 0, so a series starting
+        later holds its first frame back to it.
+        """
+        step = times[1] - times[0] if times.shape[0] > 1 else times[0]
+        k = int(round(times[0]/step))
+        if k < 1 or abs(k*step - times[0]) > 1e-6*step:
+            raise ValueError('%s: first time %g is not a multiple of the time '
+                             'step %g' % (self.path, times[0], step))
+        nblock = int(max(1, min(k, CHUNK_BYTES // (8*self.nvalues))))
+        block = np.broadcast_to(frame.reshape(self.shape),
+                                (nblock,) + self.shape)
+        var = self._f.variables
+        for i in xrange(0, k, nblock):
+            m = min(nblock, k - i)
+            var['time'][i:i+m] = step*np.arange(i, i + m)
+            var['time_series'][i:i+m] = block[:m]
+        self.nframes += k
+
+    def write_constant(self, times, frame):
+        """Append frames with times (n,) that all hold the values of frame.
+
+        The binary block is filled with frame once, later calls with the
+        same frame only rewrite its times.
+        """
+        times = np.atleast_1d(times)
+        n = times.shape[0]
+        frame = np.ravel(frame)
+        if self.fmt != 'binary':
+            self.write(times, np.broadcast_to(frame, (n, frame.shape[0])))
+            return
+        # Comparing one frame is cheap next to refilling the block
+        if (self._const is None or self._frames.shape[0] < n or
+                not np.array_equal(self._const, frame)):
+            self._frames = empty_frames(n, self.nvalues, self.dtype,
+                                        self.layout, self.marker)
+            self._frames['values'] = frame
+            self._const = frame.copy()
+        frames = self._frames[:n]
+        frames['time'] = times
+        frames.tofile(self._f)
+        self.nframes += n
+
+    def close(self):
+        if self.fmt == 'netcdf' and self.nframes > 1:
+            t = self._f.variables['time'][:2]
+            self._f.variables['time_step'][0] = t[1] - t[0]
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def frame_dtype(nvalues, dtype=DTYPE, layout='stream', marker=MARKER):
+    """Return the structured dtype of one frame.
+
+    Params:
+    -------
+    nvalues - int
+        number of values per frame, excluding the time
+    dtype - str or np.dtype
+        value dtype including byte order, e.g. '<f4' or '>f8'
+    layout - str
+        'stream' or 'record'
+    marker - str or np.dtype
+        record marker dtype, takes the byte order of dtype
+    """
+    dtype = np.dtype(dtype)
+    fields = [('time', dtype), ('values', dtype, (nvalues,))]
+    if layout == 'record':
+        marker = np.dtype(marker)
+        if dtype.byteorder in '<>':
+            marker = marker.newbyteorder(dtype.byteorder)
+        fields = [('head', marker)] + fields + [('tail', marker)]
+    elif layout != 'stream':
+        raise ValueError('Unknown layout: %s' % layout)
+    return np.dtype(fields)
+
+
+def record_bytes(fdt):
+    """Return the record length of frame dtype fdt, without markers."""
+    return fdt['time'].itemsize + fdt['values'].itemsize
+
+
+def empty_frames(nframes, nvalues, dtype=DTYPE, layout='stream',
+                 marker=MARKER):
+    """Return a zeroed block of nframes frames with record markers set.
+
+    Fill frames['time'] and frames['values'], then write with tofile.
+    """
+    fdt = frame_dtype(nvalues, dtype, layout, marker)
+    frames = np.zeros((nframes,), dtype=fdt)
+    if layout == 'record':
+        frames['head'] = record_bytes(fdt)
+        frames['tail'] = record_bytes(fdt)
+    return frames
+
+
+def guess_format(path):
+    """Return the backend of a new file from its name.
+
+    'netcdf' for .nc, 'binary' for 2D and 3D files (uv3D.th, elev2D.th)
+    and 'ascii' for anything else (elev.th, flux.th).
+    """
+    name = os.path.basename(path)
+    if name.endswith('.nc'):
+        return 'netcdf'
+    if '2D' in name or '3D' in name:
+        return 'binary'
+    return 'ascii'
+
+
+def sniff_format(path):
+    """Return the backend of an existing file from its name and content."""
+    if path.endswith('.nc'):
+        return 'netcdf'
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+    if head.lstrip().startswith('#') or (head and
+                                         not head.strip(ASCII_CHARS)):
+        return 'ascii'
+    return 'binary'
+
+
+def _create_nc_th(path, shape, dtype=DTYPE):
+    """Create and return an empty SCHISM *.th.nc file.
+
+    time_step is set by ThWriter.close, SCHISM takes record i (1-based) as
+    t = (i - 1)*time_step.
+    """
+    import netCDF4 as nc
+
+    d = nc.Dataset(path, 'w')
+    d.createDimension('time', None)
+    d.createDimension('one', 1)
+    for name, size in zip(['nOpenBndNodes', 'nLevels', 'nComponents'],
+                          shape):
+        d.createDimension(name, size)
+    d.createVariable('time_step', 'f4', ('one',))
+    d.createVariable('time', 'f8', ('time',))
+    d.createVariable('time_series', np.dtype(dtype).str[1:],
+                     ('time', 'nOpenBndNodes', 'nLevels', 'nComponents'))
+    return d
+
+
+def write_th(path, times, values, fmt=None, dtype=DTYPE, layout='stream',
+             marker=MARKER, ascii_fmt=ASCII_FMT, time_fmt=None,
+             chunk_bytes=CHUNK_BYTES):
+    """Write times (nt,) and values (nt, ...) as a .th file.
+
+    Params:
+    -------
+    path - str
+        path to new .th file
+    times - np.array (nt,)
+        frame times [s]
+    values - np.array (nt,), (nt, nnodes) or (nt, nnodes, nvrt, ncomp)
+        frame values
+    fmt - str, optional
+        'ascii', 'binary' or 'netcdf', see guess_format, (nt, nnodes, nvrt,
+        ncomp) values default to binary for names other than .nc
+    dtype, layout, marker, ascii_fmt, time_fmt
+        see ThWriter
+    chunk_bytes - int
+        approximate size of the values written per block
+    """
+    times = np.asarray(times)
+    values = np.asarray(values)
+    shape = values.shape[1:] or (1,)
+    if fmt is None and len(shape) > 1 and guess_format(path) == 'ascii':
+        fmt = 'binary'
+    nvalues = int(np.prod(shape))
+    nframes = int(max(1, min(CHUNK_ROWS, chunk_bytes // (8*nvalues))))
+    with ThWriter(path, shape, fmt, dtype, layout, marker, ascii_fmt,
+                  time_fmt) as w:
+        for start in xrange(0, times.shape[0], nframes):
+            w.write(times[start:start+nframes], values[start:start+nframes])
+
+
+def read_th(path, nnodes=None, nvrt=1, ncomp=1, fmt=None, dtype=DTYPE,
+            layout=None):
+    """Return a TimeHistory of a .th file in any backend.
+
+    Params:
+    -------
+    path - str
+        path to .th file
+    nnodes, nvrt, ncomp - int
+        frame shape of binary files, ASCII files are read whole as
+        (time, column, 1, 1) and NetCDF files carry their shape
+    fmt - str, optional
+        'ascii', 'binary' or 'netcdf', see sniff_format
+    dtype, layout
+        binary frame type, see frame_dtype
+    """
+    fmt = fmt or sniff_format(path)
+    if fmt == 'ascii':
+        blocks = list(iter_ascii_th(path))
+        if not blocks:
+            raise ValueError('%s has no rows' % path)
+        values = np.concatenate([v for _, v in blocks])
+        return TimeHistory(np.concatenate([t for t, _ in blocks]),
+                           values.reshape(values.shape + (1, 1)))
+    if fmt == 'binary':
+        if nnodes is None:
+            raise ValueError('nnodes is needed to read binary %s' % path)
+        return Th3D(path, nnodes, nvrt, ncomp, dtype, layout)
+    if fmt == 'netcdf':
+        import netCDF4 as nc
+
+        d = nc.Dataset(path)
+        d.set_auto_mask(False)
+        return TimeHistory(d.variables['time'][:], d.variables['time_series'],
+                           d)
+    raise ValueError('Unknown format: %s' % fmt)
+
+
+def format_rows(times, values, fmt=ASCII_FMT, time_fmt=None):
+    """Return 'time value ...' rows of times (n,) and values (n, ...) as str.
+
+    fmt formats the values and time_fmt the times, defaulting to fmt.
+    """
+    table = np.column_stack((times, values))
+    row = ' '.join([time_fmt or fmt] + [fmt]*(table.shape[1] - 1)) + '\n'
+    return (row*table.shape[0]) % tuple(table.ravel())
+
+
+def write_ascii_th_blocks(path, blocks, fmt=ASCII_FMT, time_fmt=None):
+    """Write (times, values) blocks as rows of an ASCII .th file.
+
+    Params:
+    -------
+    path - str
+        path to new .th file
+    blocks - iterable
+        yields times (n,) and values (n,) or (n, ncols) per block
+    fmt, time_fmt - str
+        format of one value and of the time, see format_rows
+    """
+    with ThWriter(path, fmt='ascii', ascii_fmt=fmt, time_fmt=time_fmt) as w:
+        for times, values in blocks:
+            w.write(times, values)
+
+
+def iter_ascii_th(path, chunk=CHUNK_ROWS):
+    """Yield (times, values) blocks of up to chunk rows of an ASCII .th file.
+
+    values is (n, ncols).  Blank lines and lines starting with '#' are
+    skipped, each block is parsed with one np.fromstring call.
+    """
+    with open(path) as f:
+        rows = (l for l in f if l.strip() and not l.lstrip().startswith('#'))
+        ncols = None
+        while True:
+            lines = list(itertools.islice(rows, chunk))
+            if not lines:
+                break
+            if ncols is None:
+                ncols = len(lines[0].split())
+            data = np.fromstring(''.join(lines), sep=' ')
+            if data.shape[0] != len(lines)*ncols:
+                raise ValueError('%s: rows do not all have %d columns'
+                                 % (path, ncols))
+            data = data.reshape((len(lines), ncols))
+            yield data[:, 0], data[:, 1:]
+
+
+def iter_th(path, nnodes=None, nvrt=1, ncomp=1, fmt=None, dtype=DTYPE,
+            layout=None, chunk_bytes=CHUNK_BYTES):
+    """Yield (times, values) blocks of a .th file in any backend.
+
+    values is (n, ncols) for ASCII files and (n, nnodes, nvrt, ncomp)
+    otherwise.  Binary and NetCDF blocks are read chunk_bytes at a time,
+    ASCII blocks CHUNK_ROWS rows at a time, see read_th for the other
+    params.
+    """
+    fmt = fmt or sniff_format(path)
+    if fmt == 'ascii':
+        for block in iter_ascii_th(path):
+            yield block
+        return
+    hist = read_th(path, nnodes, nvrt, ncomp, fmt, dtype, layout)
+    try:
+        size = np.dtype(dtype).itemsize*int(np.prod(hist.values.shape[1:]))
+        nframes = int(max(1, chunk_bytes // size))
+        for start in xrange(0, hist.nframes, nframes):
+            yield (np.array(hist.times[start:start+nframes]),
+                   np.array(hist.values[start:start+nframes]))
+    finally:
+        hist.close()
+
+
+def write_ascii_th(path, times, values, fmt=ASCII_FMT, time_fmt=None,
+                   chunk=CHUNK_ROWS):
+    """Write times (nt,) and values (nt,) or (nt, ncols) as ASCII .th.
+
+    Rows are formatted chunk rows at a time.
+    """
+    blocks = ((times[i:i+chunk], values[i:i+chunk])
+              for i in xrange(0, len(times), chunk))
+    write_ascii_th_blocks(path, blocks, fmt, time_fmt)
+
+
+def detect_layout(path, nvalues, dtype=DTYPE, marker=MARKER):
+    """Return 'record' if path starts with a matching record marker.
+
+    Otherwise 'stream' is returned, the file is not checked further.
+    """
+    fdt = frame_dtype(nvalues, dtype, 'record', marker)
+    size = os.path.getsize(path)
+    if size and size % fdt.itemsize == 0:
+        head = np.fromfile(path, dtype=fdt['head'], count=1)
+        if head[0] == record_bytes(fdt):
+            return 'record'
+    return 'stream'
+
+
+def open_th(path, nvalues, dtype=DTYPE, layout=None, marker=MARKER,
+            mode='r'):
+    """Return the frames of a binary .th file as a memory-mapped array.
+
+    Fields are 'time' and 'values' (plus 'head' and 'tail' for records),
+    nothing is read until they are indexed.
+
+    Params:
+    -------
+    path - str
+        path to .th file
+    nvalues - int
+        number of values per frame, excluding the time
+    layout - str, optional
+        'stream' or 'record', detected if not given
+    mode - str
+        np.memmap mode, 'r+' to modify the file in place
+    """
+    if layout is None:
+        layout = detect_layout(path, nvalues, dtype, marker)
+    fdt = frame_dtype(nvalues, dtype, layout, marker)
+    size = os.path.getsize(path)
+    if size % fdt.itemsize:
+        raise ValueError('%s: %d bytes is not a whole number of %d byte '
+                         '%s frames' % (path, size, fdt.itemsize, layout))
+    if size == 0:
+        return np.zeros((0,), dtype=fdt)
+    return np.memmap(path, dtype=fdt, mode=mode,
+                     shape=(size // fdt.itemsize,))
+
+
+def _frames(bad):
+    """Return 1-based frame numbers where bad is True, up to MAX_FRAMES."""
+    return (np.nonzero(bad)[0][:MAX_FRAMES] + 1).tolist()
+
+
+def validate_th(path, nvalues, dtype=DTYPE, layout=None, marker=MARKER,
+                ntimesteps=None, dt=None):
+    """Check a binary .th file and return a report dict.
+
+    Checks that the file is a whole number of frames, record markers match
+    the frame size, times are finite and increasing and, if given, the
+    frame count is ntimesteps and frame i has time i*dt.
+
+    Params:
+    -------
+    path - str
+        path to .th file
+    nvalues - int
+        number of values per frame, excluding the time
+    layout - str, optional
+        'stream' or 'record', detected if not given
+    ntimesteps - int, optional
+        expected number of frames
+    dt - float, optional
+        expected time step [s]
+    """
+    if layout is None:
+        layout = detect_layout(path, nvalues, dtype, marker)
+    fdt = frame_dtype(nvalues, dtype, layout, marker)
+    size = os.path.getsize(path)
+    nframes = size // fdt.itemsize
+    report = {'errors': [], 'layout': layout, 'nframes': nframes,
+              'frame_bytes': fdt.itemsize, 'size': size}
+    errors = report['errors']
+    if size % fdt.itemsize:
+        errors.append('%d bytes is %.3f frames of %d bytes'
+                      % (size, float(size)/fdt.itemsize, fdt.itemsize))
+    if ntimesteps is not None and nframes != ntimesteps:
+        errors.append('%d frames, expected %d' % (nframes, ntimesteps))
+    if nframes == 0:
+        errors.append('no complete frames')
+        return report
+
+    frames = np.memmap(path, dtype=fdt, mode='r', shape=(nframes,))
+    if layout == 'record':
+        nbytes = record_bytes(fdt)
+        bad = (frames['head'] != nbytes) | (frames['tail'] != nbytes)
+        if bad.any():
+            errors.append('%d record markers differ from %d, frames %s'
+                          % (bad.sum(), nbytes, _frames(bad)))
+
+    times = np.array(frames['time'], dtype=np.float64)
+    report['t0'] = times[0]
+    report['t1'] = times[-1]
+    bad = ~np.isfinite(times)
+    if bad.any():
+        errors.append('%d non-finite times, frames %s'
+                      % (bad.sum(), _frames(bad)))
+    bad = np.concatenate(([False], ~(np.diff(times) > 0)))
+    if bad.any():
+        errors.append('%d times not increasing, frames %s'
+                      % (bad.sum(), _frames(bad)))
+    if nframes > 1:
+        report['dt'] = float(np.median(np.diff(times)))
+    if dt is not None:
+        expected = dt*np.arange(1, nframes + 1)
+        # Stored times are rounded to dtype
+        tol = 2*np.spacing(np.abs(expected).astype(fdt['time']))
+        bad = ~(np.abs(times - expected) <= tol)
+        if bad.any():
+            errors.append('%d times differ from i*dt, frames %s'
+                          % (bad.sum(), _frames(bad)))
+    del frames
+    return report
+
+
+def write_node_history(path, th3d, i, t0=None, t1=None):
+    """Write time and node i's values per frame as an ASCII table."""
+    start, stop = th3d.frame_range(t0, t1)
+    hist = th3d.node(i, start, stop).reshape((stop - start, -1))
+    table = np.column_stack((th3d.times[start:stop], hist))
+    fmt = '%f' + ' %f'*hist.shape[1] + '\n'
+    with open(path, 'w') as f:
+        f.write((fmt*table.shape[0]) % tuple(table.ravel()))
+
+
+def print_report(report, path):
+    """Print a validate_th report."""
+    print 'File    : %s' % path
+    print 'Layout  : %s' % report['layout']
+    print 'Frames  : %d of %d bytes' % (report['nframes'],
+                                        report['frame_bytes'])
+    if 't0' in report:
+        print 'Times   : %g to %g s' % (report['t0'], report['t1'])
+    if 'dt' in report:
+        print 'dt      : %g s' % report['dt']
+    if report['errors']:
+        print 'FAILED'
+        for e in report['errors']:
+            print '- %s' % e
+    else:
+        print 'OK'
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('th_file', type=str, help='Binary .th file.')
+    parser.add_argument('nnodes', type=int, help='Number of boundary nodes.')
+    parser.add_argument('nvrt', type=int, help='Number of vertical levels.')
+    parser.add_argument('-c', '--ncomp', type=int, default=1,
+                        help='Values per node and level, 2 for uv3D.th.')
+    parser.add_argument('-l', '--layout', choices=LAYOUTS,
+                        help='Frame layout, detected if not given.')
+    parser.add_argument('-d', '--dtype', default=DTYPE,
+                        help='Value dtype with byte order, e.g. >f4.')
+    parser.add_argument('-n', '--ntimesteps', type=int,
+                        help='Expected number of frames.')
+    parser.add_argument('--dt', type=float, help='Expected time step [s].')
+    parser.add_argument('--node', type=int,
+                        help='Write the history of this 1-based node.')
+    parser.add_argument('-o', '--output', default='node.txt',
+                        help='Output file of --node.')
+    parser.add_argument('--t0', type=float, help='Start time of --node [s].')
+    parser.add_argument('--t1', type=float, help='End time of --node [s].')
+    args = parser.parse_args()
+
+    if args.node:
+        th3d = Th3D(args.th_file, args.nnodes, args.nvrt, args.ncomp,
+                    args.dtype, args.layout)
+        write_node_history(args.output, th3d, args.node - 1, args.t0,
+                           args.t1)
+        return
+
+    report = validate_th(args.th_file, args.nnodes*args.nvrt*args.ncomp,
+                         args.dtype, args.layout, ntimesteps=args.ntimesteps,
+                         dt=args.dt)
+    print_report(report, args.th_file)
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
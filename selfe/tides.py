@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""Synthesize boundary elevations from tidal constituents.
+
+Elevations are the harmonic sum over constituents at every boundary node:
+
+    eta(t, node) = z0 + sum_k f_k*A(node, k)*cos(omega_k*t - (phi(node, k) - u_k))
+
+evaluated a block of time steps at a time as two matrix products over the
+constituents.  For equally spaced times, cos(omega*tau) and sin(omega*tau)
+of one block are tabulated once and every block is rotated to its start
+time, so only ncons new cosines are needed per block.
+
+Harmonics are read from a text file with one row per constituent, or per
+node and constituent:
+
+    # name amp[m] phase[deg]          # node name amp[m] phase[deg]
+    M2 0.95 232.1                     1 M2 0.95 232.1
+    K1 0.40 241.3                     1 K1 0.40 241.3
+                                      2 M2 0.97 233.0 ...
+
+Constituent speeds come from SPEEDS, other names need a period.  Nodal
+factors f and u default to 1 and 0 and can be passed to Harmonics.
+
+Output is either elev2D.th (binary frames of all nodes, see th.py, or
+SCHISM NetCDF for elev2D.th.nc) or an ASCII elev.th with one column per
+node.
+
+Example:
+    ./tides.py harmonics.txt 30 90 -o elev2D.th
+    ./tides.py harmonics.txt 30 90 --ascii -o elev.th -p sd 12
+
+Jesse E. Lopez
+"""
+import numpy as np
+
+import th
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+# Constituent speeds [deg/hour]
+SPEEDS = {
+    'M2': 28.9841042, 'S2': 30.0000000, 'N2': 28.4397295,
+    'K2': 30.0821373, '2N2': 27.8953548, 'MU2': 27.9682084,
+    'NU2': 28.5125831, 'L2': 29.5284789, 'T2': 29.9589333,
+    'K1': 15.0410686, 'O1': 13.9430356, 'P1': 14.9589314,
+    'Q1': 13.3986609, 'J1': 15.5854433, 'OO1': 16.1391017,
+    'M4': 57.9682084, 'MS4': 58.9841042, 'MN4': 57.4238337,
+    'S4': 60.0000000, 'M6': 86.9523127, 'M8': 115.9364166,
+    'MF': 1.0980331, 'MM': 0.5443747, 'SSA': 0.0821373, 'SA': 0.0410686,
+}
+# Values evaluated per block, bounds the size of the block buffers
+CHUNK_VALUES = 4000000
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class Harmonics(object):
+    """Constituent amplitudes and phases at boundary nodes.
+
+    Params:
+    -------
+    names - list of str
+        constituent names
+    omega - np.array (ncons,)
+        angular speeds [rad/s]
+    amp - np.array (nnodes, ncons)
+        amplitudes [m]
+    phase - np.array (nnodes, ncons)
+        phases [deg]
+    z0 - float or np.array (nnodes,)
+        mean elevation
+    f, u - np.array (ncons,), optional
+        nodal amplitude factors and phase corrections [deg]
+    """
+    def __init__(self, names, omega, amp, phase, z0=0.0, f=None, u=None):
+        self.names = list(names)
+        self.omega = np.asarray(omega, dtype=np.float64)
+        amp = np.atleast_2d(amp)*(1.0 if f is None else np.asarray(f))
+        phase = np.radians(np.atleast_2d(phase) - (0.0 if u is None else
+                                                    np.asarray(u)))
+        # Phase table of the constituents, cos(wt - p) = cos wt cos p +
+        # sin wt sin p
+        self.acos = amp*np.cos(phase)
+        self.asin = amp*np.sin(phase)
+        self.z0 = z0
+
+    @property
+    def nnodes(self):
+        return self.acos.shape[0]
+
+    @property
+    def ncons(self):
+        return self.acos.shape[1]
+
+    def _chunk(self, chunk):
+        if chunk is None:
+            chunk = CHUNK_VALUES // (self.nnodes + self.ncons)
+        return max(1, chunk)
+
+    def synthesize(self, times, chunk=None):
+        """Return elevations (ntimes, nnodes) at arbitrary times [s]."""
+        times = np.asarray(times, dtype=np.float64)
+        chunk = self._chunk(chunk)
+        out = np.empty((times.shape[0], self.nnodes))
+        for i in xrange(0, times.shape[0], chunk):
+            wt = np.outer(times[i:i+chunk], self.omega)
+            out[i:i+chunk] = self.z0 + np.dot(np.cos(wt), self.acos.T) + \
+                np.dot(np.sin(wt), self.asin.T)
+        return out
+
+    def iter_blocks(self, ntimesteps, dt, start=0.0, chunk=None):
+        """Yield (times, elevations) blocks for times dt ... ntimesteps*dt.
+
+        Harmonics are evaluated at start + times, times start at dt as in
+        SELFE .th files.
+        """
+        chunk = min(self._chunk(chunk), max(ntimesteps, 1))
+        wtau = np.outer(dt*np.arange(chunk), self.omega)
+        cos_tab = np.cos(wtau)
+        sin_tab = np.sin(wtau)
+        for i in xrange(0, ntimesteps, chunk):
+            n = min(chunk, ntimesteps - i)
+            wt0 = self.omega*(start + dt*(i + 1))
+            c0 = np.cos(wt0)
+            s0 = np.sin(wt0)
+            cos_wt = cos_tab[:n]*c0 - sin_tab[:n]*s0
+            sin_wt = sin_tab[:n]*c0 + cos_tab[:n]*s0
+            eta = self.z0 + np.dot(cos_wt, self.acos.T) + \
+                np.dot(sin_wt, self.asin.T)
+            yield dt*np.arange(i + 1, i + n + 1), eta
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def constituent_omega(names, periods=None):
+    """Return angular speeds [rad/s] of constituents.
+
+    Params:
+    -------
+    names - list of str
+        constituent names, looked up in SPEEDS case insensitively
+    periods - dict, optional
+        periods [hours] of constituents not in SPEEDS, or overriding it
+    """
+    periods = dict((k.upper(), v) for k, v in (periods or {}).items())
+    omega = []
+    for name in names:
+        key = name.upper()
+        if key in periods:
+            omega.append(2*np.pi/(periods[key]*3600.0))
+        elif key in SPEEDS:
+            omega.append(np.radians(SPEEDS[key])/3600.0)
+        else:
+            raise ValueError('Unknown constituent %s, give its period' % name)
+    return np.array(omega)
+
+
+def read_harmonics(path, nnodes=1, periods=None):
+    """Read harmonics file and return Harmonics.
+
+    Params:
+    -------
+    path - str
+        'name amp phase' or 'node name amp phase' rows, '#' comments
+    nnodes - int
+        number of nodes sharing the harmonics of a 3 column file
+    periods - dict, optional
+        see constituent_omega
+    """
+    with open(path) as f:
+        rows = [l.split('#')[0].split() for l in f]
+    rows = np.array([r for r in rows if r])
+    if rows.shape[1] == 3:
+        rows = np.column_stack((np.ones(rows.shape[0], dtype=int), rows))
+    elif rows.shape[1] != 4:
+        raise ValueError('%s: expected 3 or 4 columns' % path)
+
+    node = rows[:, 0].astype(np.int64) - 1
+    names, first, cons = np.unique(rows[:, 1], return_index=True,
+                                   return_inverse=True)
+    # Keep constituents in file order
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0])
+    cons = rank[cons]
+    names = names[order].tolist()
+
+    amp = np.zeros((node.max() + 1, len(names)))
+    phase = np.zeros(amp.shape)
+    amp[node, cons] = rows[:, 2].astype(np.float64)
+    phase[node, cons] = rows[:, 3].astype(np.float64)
+    if amp.shape[0] == 1:
+        amp = np.repeat(amp, nnodes, axis=0)
+        phase = np.repeat(phase, nnodes, axis=0)
+    return Harmonics(names, constituent_omega(names, periods), amp, phase)
+
+
+def write_elev_th(path, harm, ntimesteps, dt, start=0.0, fmt=th.ASCII_FMT):
+    """Write an ASCII elev.th with one column per node."""
+    print 'Writing %s' % path
+    th.write_ascii_th_blocks(path, harm.iter_blocks(ntimesteps, dt, start),
+                             fmt)
+
+
+def write_elev2D_th(path, harm, ntimesteps, dt, start=0.0, layout='stream',
+                    dtype=th.DTYPE):
+    """Write a binary elev2D.th (or elev2D.th.nc) with one frame per step.
+
+    Params:
+    -------
+    path - str
+        path to new elev2D.th, NetCDF if it ends with .nc, which also
+        gets a frame at t = 0
+    harm - Harmonics
+        harmonics of the boundary nodes, in elev2D.th node order
+    ntimesteps - int
+        number of frames
+    dt - float
+        time step [s]
+    start - float
+        time of the first frame minus dt, relative to the harmonics' phases
+    layout, dtype
+        see th.frame_dtype
+    """
+    print 'Writing %s' % path
+    fmt = 'netcdf' if path.endswith('.nc') else 'binary'
+    with th.ThWriter(path, (harm.nnodes,), fmt, dtype, layout) as w:
+        if fmt == 'netcdf':
+            # *.th.nc starts at t = 0, evaluate it rather than hold frame 1
+            w.write(0.0, harm.synthesize([start]))
+        for times, eta in harm.iter_blocks(ntimesteps, dt, start):
+            w.write(times, eta)
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('harmonics', type=str, help='Harmonics file.')
+    parser.add_argument('ndays', type=float, help='Number of days.')
+    parser.add_argument('dt', type=float, help='Time step [s].')
+    parser.add_argument('-o', '--output', type=str,
+                        help='Output file, elev2D.th or elev.th with --ascii.')
+    parser.add_argument('-a', '--ascii', action='store_true', default=False,
+                        help='Write ASCII elev.th instead of binary.')
+    parser.add_argument('-n', '--nnodes', type=int, default=1,
+                        help='Nodes sharing 3 column harmonics.')
+    parser.add_argument('-s', '--start', type=float, default=0.0,
+                        help='Start time relative to the phases [s].')
+    parser.add_argument('-z', '--z0', type=float, default=0.0,
+                        help='Mean elevation [m].')
+    parser.add_argument('-p', '--period', nargs=2, action='append',
+                        default=[], metavar=('NAME', 'HOURS'),
+                        help='Period of a constituent not in SPEEDS.')
+    parser.add_argument('--layout', choices=th.LAYOUTS, default='stream',
+                        help='elev2D.th frame layout.')
+    parser.add_argument('--dtype', default=th.DTYPE,
+                        help='elev2D.th dtype with byte order.')
+    args = parser.parse_args()
+
+    periods = dict((n, float(h)) for n, h in args.period)
+    harm = read_harmonics(args.harmonics, args.nnodes, periods)
+    harm.z0 = args.z0
+    nts = int(args.ndays*86400/args.dt)
+    print '%d constituents at %d nodes, %d steps' % (harm.ncons, harm.nnodes,
+                                                      nts)
+    if args.ascii:
+        write_elev_th(args.output or 'elev.th', harm, nts, args.dt,
+                      args.start)
+    else:
+        write_elev2D_th(args.output or 'elev2D.th', harm, nts, args.dt,
+                        args.start, args.layout, args.dtype)
+
+if __name__ == '__main__':
+    main()
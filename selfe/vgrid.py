@@ -0,0 +1,362 @@
+"""Read, write and evaluate SELFE/SCHISM vgrid.in files.
+
+Two vertical grid types are supported:
+    SZGrid   - SELFE SZ hybrid, kz Z levels from the deepest depth up to
+               -h_s and S levels above it, pure S when kz == 1.  SCHISM
+               ivcor=2 files are read too.
+    LSC2Grid - SCHISM ivcor=1, localized sigma levels with a bottom level
+               and sigma values per node, in the per-node row layout or
+               the per-level column layout of newer SCHISM versions.
+
+Level elevations are computed for all nodes at once, returning Z
+(nvrt, nnodes) with level 1 (the bottom) first and levels below the bed set
+to -depth.  computeVerticalCoordinates has the same signature as
+selfeGridUtils.verticalCoordinates, so either grid can be passed as vgrid
+to make_3Dth.load_velocity_profile.
+
+Example:
+    import vgrid
+    vg = vgrid.make_lsc2(grid.depth, 41, dz=0.5)
+    vgrid.write_vgrid('vgrid.in', vg)
+    Z, kbp, iwet = vgrid.read_vgrid('vgrid.in').computeVerticalCoordinates(
+        eta, grid.depth)
+
+Jesse E. Lopez
+"""
+import numpy as np
+
+import gr3
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+# Total depth below which a node is dry
+DRY_DEPTH = 0.01
+# Sigma value of levels below the bed in the LSC2 level layout
+LSC2_FILL = -9.0
+LEVEL_FMT = '%d %f\n'
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+class SZGrid(object):
+    """SELFE SZ hybrid vertical grid.
+
+    ztot holds the Z levels bottom first, ending at -h_s, and sigma the S
+    levels from -1 (at -h_s or the bed) to 0 (at the surface).
+    """
+    def __init__(self, ztot, sigma, h_s, h_c, theta_b, theta_f):
+        self.ztot = np.asarray(ztot, dtype=np.float64)
+        self.sigma = np.asarray(sigma, dtype=np.float64)
+        self.h_s = float(h_s)
+        self.h_c = float(h_c)
+        self.theta_b = float(theta_b)
+        self.theta_f = float(theta_f)
+
+    @property
+    def kz(self):
+        return self.ztot.shape[0]
+
+    @property
+    def nvrt(self):
+        return self.kz + self.sigma.shape[0] - 1
+
+    def s_curve(self):
+        """Return the S coordinate stretching C(sigma) of the S levels."""
+        return s_curve(self.sigma, self.theta_b, self.theta_f)
+
+    def computeVerticalCoordinates(self, eta, dp):
+        """Return Z (nvrt, n), kbp (n,) and iwet (n,) at the nodes.
+
+        kbp is the 0-based bottom level and iwet 1 where the total depth
+        exceeds DRY_DEPTH.
+        """
+        eta, dp = _columns(eta, dp)
+        n = dp.shape[0]
+        Z = np.empty((self.nvrt, n))
+
+        # S levels, referenced to the bed where it is above -h_s
+        sig = self.sigma[:, None]
+        h = np.minimum(dp, self.h_s)[None, :]
+        deep = eta[None, :]*(1 + sig) + self.h_c*sig + \
+            (h - self.h_c)*self.s_curve()[:, None]
+        shallow = sig*(h + eta[None, :]) + eta[None, :]
+        Z[self.kz - 1:] = np.where(h <= self.h_c, shallow, deep)
+
+        # Z levels, the one just below the bed moves up to it
+        kbp = np.empty((n,), dtype=np.int64)
+        kbp.fill(self.kz - 1)
+        if self.kz > 1:
+            below_hs = dp > self.h_s
+            k = np.searchsorted(self.ztot, -dp, side='right') - 1
+            if (below_hs & (k < 0)).any():
+                raise ValueError('Depth %g is below the deepest Z level %g'
+                                 % (dp.max(), self.ztot[0]))
+            kbp[below_hs] = k[below_hs]
+            Z[:self.kz - 1] = self.ztot[:self.kz - 1, None]
+            Z[kbp[below_hs], np.nonzero(below_hs)[0]] = -dp[below_hs]
+        _fill_below(Z, kbp, dp)
+
+        return Z, kbp, ((eta + dp) > DRY_DEPTH).astype(np.int8)
+
+
+class LSC2Grid(object):
+    """SCHISM LSC2 vertical grid with per-node sigma levels.
+
+    sigma is (nvrt, nnodes), -1 at level kbp (0-based) and 0 at the surface,
+    NaN below kbp.
+    """
+    def __init__(self, kbp, sigma):
+        self.kbp = np.asarray(kbp, dtype=np.int64)
+        self.sigma = np.asarray(sigma, dtype=np.float64)
+
+    @property
+    def nvrt(self):
+        return self.sigma.shape[0]
+
+    @property
+    def nnodes(self):
+        return self.sigma.shape[1]
+
+    def computeVerticalCoordinates(self, eta, dp, nodes=None):
+        """Return Z (nvrt, n), kbp (n,) and iwet (n,) at the nodes.
+
+        nodes selects the grid nodes eta and dp belong to, defaults to all.
+        """
+        kbp = self.kbp
+        sigma = self.sigma
+        if nodes is not None:
+            kbp = kbp[nodes]
+            sigma = sigma[:, nodes]
+        eta, dp = _columns(eta, dp)
+        eta = np.broadcast_to(eta, kbp.shape)
+        dp = np.broadcast_to(dp, kbp.shape)
+
+        Z = eta[None, :] + (eta + dp)[None, :]*sigma
+        _fill_below(Z, kbp, dp)
+        return Z, kbp, ((eta + dp) > DRY_DEPTH).astype(np.int8)
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+def _columns(eta, dp):
+    """Return eta and dp as broadcast 1D float arrays."""
+    return np.broadcast_arrays(np.ravel(eta).astype(np.float64),
+                               np.ravel(dp).astype(np.float64))
+
+
+def _fill_below(Z, kbp, dp):
+    """Set levels of Z below the bottom level kbp to -dp."""
+    below = np.arange(Z.shape[0])[:, None] < kbp[None, :]
+    Z[below] = np.broadcast_to(-dp, kbp.shape)[np.nonzero(below)[1]]
+
+
+def s_curve(sigma, theta_b, theta_f):
+    """Return the Song and Haidvogel S coordinate stretching of sigma."""
+    sigma = np.asarray(sigma, dtype=np.float64)
+    if theta_f <= 0:
+        return sigma.copy()
+    surf = np.sinh(theta_f*sigma)/np.sinh(theta_f)
+    bot = (np.tanh(theta_f*(sigma + 0.5)) - np.tanh(theta_f*0.5)) / \
+        (2*np.tanh(theta_f*0.5))
+    return (1 - theta_b)*surf + theta_b*bot
+
+
+def make_sz(nsigma, h_s=100.0, h_c=7.0, theta_b=1.0, theta_f=10.0,
+            ztot=None):
+    """Return an SZGrid with nsigma evenly spaced S levels.
+
+    Params:
+    -------
+    nsigma - int
+        number of S levels
+    h_s - float
+        depth of the transition from Z to S levels
+    h_c, theta_b, theta_f - float
+        S coordinate parameters
+    ztot - list of float, optional
+        Z levels bottom first, ending at -h_s, defaults to pure S
+    """
+    if ztot is None:
+        ztot = [-h_s]
+    ztot = np.asarray(ztot, dtype=np.float64)
+    if ztot[-1] != -h_s:
+        raise ValueError('Last Z level %g must be -h_s (%g)'
+                         % (ztot[-1], -h_s))
+    if (np.diff(ztot) <= 0).any():
+        raise ValueError('Z levels must increase from the bottom up')
+    return SZGrid(ztot, np.linspace(-1, 0, nsigma), h_s, h_c, theta_b,
+                  theta_f)
+
+
+def make_lsc2(dp, nvrt, dz=1.0, min_levels=2, theta_b=0.0, theta_f=0.0):
+    """Return an LSC2Grid with levels about dz apart at every node.
+
+    Params:
+    -------
+    dp - np.array (nnodes,)
+        node depths
+    nvrt - int
+        maximum number of levels
+    dz - float
+        target level spacing, deep nodes get all nvrt levels
+    min_levels - int
+        number of levels of the shallowest nodes
+    theta_b, theta_f - float
+        S coordinate stretching of each node's levels, none if theta_f is 0
+    """
+    dp = np.asarray(dp, dtype=np.float64)
+    nlev = np.ceil(np.maximum(dp, 0)/dz).astype(np.int64) + 1
+    nlev = np.clip(nlev, min_levels, nvrt)
+    kbp = nvrt - nlev
+
+    j = np.arange(nvrt)[:, None] - kbp[None, :]
+    with np.errstate(invalid='ignore'):
+        sigma = -1.0 + j/(nlev[None, :] - 1.0)
+        sigma[j < 0] = np.nan
+        sigma = s_curve(sigma, theta_b, theta_f)
+    return LSC2Grid(kbp, sigma)
+
+
+def _strip(line):
+    """Return line without a trailing ! comment."""
+    return line.split('!')[0].strip()
+
+
+def _read_sz(lines):
+    """Return SZGrid from lines starting at 'nvrt kz h_s'."""
+    nvrt, kz, h_s = _strip(lines[0]).split()[:3]
+    nvrt = int(nvrt)
+    kz = int(kz)
+    ztot = np.fromstring(' '.join(_strip(l) for l in lines[2:2+kz]),
+                         sep=' ').reshape((kz, -1))[:, 1]
+    h_c, theta_b, theta_f = [float(v) for v in
+                             _strip(lines[3+kz]).split()[:3]]
+    nsigma = nvrt - kz + 1
+    sigma = np.fromstring(' '.join(_strip(l) for l in
+                                   lines[4+kz:4+kz+nsigma]),
+                          sep=' ').reshape((nsigma, -1))[:, 1]
+    return SZGrid(ztot, sigma, h_s, h_c, theta_b, theta_f)
+
+
+def _read_lsc2(nvrt, text):
+    """Return LSC2Grid from the node or level layout text after nvrt."""
+    rows = [r for r in text.split('\n') if r.strip()]
+    data = np.fromstring(text, sep=' ')
+    if not any(c in rows[0] for c in '.eE'):
+        # Level layout, bottom levels then one row of sigma per level
+        nnodes = (data.shape[0] - nvrt)//(nvrt + 1)
+        kbp = data[:nnodes].astype(np.int64) - 1
+        sigma = data[nnodes:].reshape((nvrt, nnodes + 1))[:, 1:].copy()
+        sigma[np.arange(nvrt)[:, None] < kbp[None, :]] = np.nan
+        return LSC2Grid(kbp, sigma)
+
+    # Node layout, 'id kbp sigma(kbp..nvrt)' per node
+    kbp = np.array([int(r.split(None, 2)[1]) for r in rows]) - 1
+    nnodes = kbp.shape[0]
+    nlev = nvrt - kbp
+    ends = np.cumsum(nlev + 2)
+    if data.shape[0] != ends[-1]:
+        raise ValueError('Expected %d values for %d nodes, found %d'
+                         % (ends[-1], nnodes, data.shape[0]))
+    node = np.repeat(np.arange(nnodes), nlev)
+    pos = np.arange(node.shape[0]) - np.repeat(np.cumsum(nlev) - nlev, nlev)
+    sigma = np.empty((nvrt, nnodes))
+    sigma.fill(np.nan)
+    sigma[kbp[node] + pos, node] = data[(ends - nlev)[node] + pos]
+    return LSC2Grid(kbp, sigma)
+
+
+def read_vgrid(path):
+    """Read vgrid.in and return an SZGrid or LSC2Grid.
+
+    Params:
+    -------
+    path - str
+        path to SELFE vgrid.in or SCHISM vgrid.in (ivcor 1 or 2)
+    """
+    with open(path) as f:
+        head = [f.readline() for _ in range(2)]
+        fields = _strip(head[0]).split()
+        if len(fields) >= 3:
+            return _read_sz(head + f.readlines())
+        ivcor = int(fields[0])
+        if ivcor == 2:
+            return _read_sz(head[1:] + f.readlines())
+        if ivcor == 1:
+            return _read_lsc2(int(_strip(head[1]).split()[0]), f.read())
+    raise ValueError('Unknown ivcor %d in %s' % (ivcor, path))
+
+
+def _write_sz(f, vg):
+    f.write('%d %d %g\n' % (vg.nvrt, vg.kz, vg.h_s))
+    f.write('Z levels\n')
+    levels = np.column_stack((np.arange(1, vg.kz + 1), vg.ztot))
+    gr3.write_rows(f, LEVEL_FMT, levels)
+    f.write('S levels\n')
+    f.write('%g %g %g\n' % (vg.h_c, vg.theta_b, vg.theta_f))
+    nsigma = vg.sigma.shape[0]
+    levels = np.column_stack((np.arange(1, nsigma + 1), vg.sigma))
+    gr3.write_rows(f, LEVEL_FMT, levels)
+
+
+def _write_lsc2_nodes(f, vg, chunk):
+    """Write 'id kbp sigma(kbp..nvrt)' rows, formatted per level count."""
+    for start in xrange(0, vg.nnodes, chunk):
+        stop = min(start + chunk, vg.nnodes)
+        kbp = vg.kbp[start:stop]
+        lines = np.empty(kbp.shape, dtype=object)
+        for k in np.unique(kbp):
+            ix = np.nonzero(kbp == k)[0]
+            block = np.column_stack((ix + start + 1,
+                                     np.repeat(k + 1, ix.shape[0]),
+                                     vg.sigma[k:, ix + start].T))
+            fmt = '%d %d' + ' %f'*(vg.nvrt - k) + '\n'
+            lines[ix] = ((fmt*ix.shape[0]) %
+                         tuple(block.ravel())).splitlines(True)
+        f.write(''.join(lines))
+
+
+def _write_lsc2_levels(f, vg, chunk):
+    """Write bottom levels, then 'k sigma(k, 1..nnodes)' per level."""
+    for start in xrange(0, vg.nnodes, chunk):
+        kbp = vg.kbp[start:start+chunk] + 1
+        f.write((' %d'*kbp.shape[0]) % tuple(kbp))
+    f.write('\n')
+    for k in xrange(vg.nvrt):
+        f.write('%d' % (k + 1))
+        for start in xrange(0, vg.nnodes, chunk):
+            sig = vg.sigma[k, start:start+chunk]
+            sig = np.where(np.isnan(sig), LSC2_FILL, sig)
+            f.write((' %f'*sig.shape[0]) % tuple(sig))
+        f.write('\n')
+
+
+def write_vgrid(path, vg, layout='nodes', chunk=gr3.CHUNK_ROWS):
+    """Write an SZGrid or LSC2Grid to vgrid.in.
+
+    Params:
+    -------
+    path - str
+        path to new vgrid.in
+    vg - SZGrid or LSC2Grid
+        vertical grid, SZGrid is written in the SELFE layout
+    layout - str
+        LSC2 layout, 'nodes' (one row per node) or 'levels' (one row per
+        level, SCHISM v5.10 and later)
+    chunk - int
+        nodes formatted per write
+    """
+    with open(path, 'w') as f:
+        if isinstance(vg, SZGrid):
+            _write_sz(f, vg)
+            return
+        f.write('1\n%d\n' % vg.nvrt)
+        if layout == 'nodes':
+            _write_lsc2_nodes(f, vg, chunk)
+        elif layout == 'levels':
+            _write_lsc2_levels(f, vg, chunk)
+        else:
+            raise ValueError('Unknown LSC2 layout: %s' % layout)